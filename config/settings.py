@@ -30,6 +30,9 @@ DEBUG = os.getenv('DEBUG', False) == 'True'
 
 ALLOWED_HOSTS = []
 
+# Адрес сайта для ссылок в письмах рассылок (например, ссылки для отписки)
+SITE_URL = os.getenv('SITE_URL', 'http://127.0.0.1:8000')
+
 # Application definition
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND')
 EMAIL_HOST = os.getenv('EMAIL_HOST')
@@ -43,6 +46,45 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
 EMAIL_ADMIN = EMAIL_HOST_USER
 
+# Настройки пула отправки рассылок: количество потоков-отправителей
+# и количество писем, отправляемых через одно SMTP соединение до его переоткрытия
+EMAIL_SEND_POOL_SIZE = int(os.getenv('EMAIL_SEND_POOL_SIZE', 8))
+EMAIL_MESSAGES_PER_CONNECTION = int(os.getenv('EMAIL_MESSAGES_PER_CONNECTION', 100))
+# Режим отправки рассылок: pool - пул потоков, asyncio - цикл событий asyncio с асинхронным SMTP клиентом
+# (в режиме asyncio письма с вложениями и отправку через другие EMAIL_BACKEND выполняет пул потоков)
+EMAIL_SEND_MODE = os.getenv('EMAIL_SEND_MODE', 'pool')
+# Максимальное количество одновременно открытых SMTP сессий в режиме asyncio
+EMAIL_ASYNC_CONCURRENCY = int(os.getenv('EMAIL_ASYNC_CONCURRENCY', 100))
+# Ограничение скорости отправки, писем в секунду (0 - без ограничения):
+# общее для SMTP аккаунта и для каждого домена получателя.
+# Ограничения действуют в пределах процесса: процессы пула отправки (NEWSLETTER_PROCESS_POOL_SIZE) делят их поровну,
+# а отдельные воркеры очереди исходящих (runoutboxworker) ограничиваются каждый сам по себе
+EMAIL_RATE_LIMIT = float(os.getenv('EMAIL_RATE_LIMIT', 0))
+EMAIL_DOMAIN_RATE_LIMIT = float(os.getenv('EMAIL_DOMAIN_RATE_LIMIT', 0))
+# Отдельные ограничения для доменов в виде "gmail.com:20,mail.ru:10"
+EMAIL_DOMAIN_RATE_LIMITS = {
+    domain.strip().lower(): float(rate)
+    for domain, rate in (item.split(':') for item in os.getenv('EMAIL_DOMAIN_RATE_LIMITS', '').split(',') if item)
+}
+# Допустимый всплеск писем сверх равномерной скорости
+EMAIL_RATE_LIMIT_BURST = int(os.getenv('EMAIL_RATE_LIMIT_BURST', 1))
+# Автомат отключения: после стольких ошибок подключения или авторизации подряд отправка приостанавливается,
+# а через EMAIL_CIRCUIT_RESET_TIMEOUT секунд пробуется одно подключение.
+# Каждый процесс пула отправки размыкает свой автомат, пока автомат разомкнут, пул процессов не используется
+EMAIL_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('EMAIL_CIRCUIT_FAILURE_THRESHOLD', 5))
+EMAIL_CIRCUIT_RESET_TIMEOUT = int(os.getenv('EMAIL_CIRCUIT_RESET_TIMEOUT', 60))
+# Группировка получателей по почтовому серверу: путь до функции domain -> mx (пусто - группировка по домену).
+# eservice.planner.static_mx_resolver берет серверы из EMAIL_MX_HOSTS вида "ya.ru:mx.yandex.net,yandex.ru:mx.yandex.net"
+EMAIL_MX_RESOLVER = os.getenv('EMAIL_MX_RESOLVER', '')
+EMAIL_MX_HOSTS = {
+    domain.strip().lower(): mx.strip()
+    for domain, mx in (item.split(':') for item in os.getenv('EMAIL_MX_HOSTS', '').split(',') if item)
+}
+# Количество получателей, читаемых из БД за один раз при отправке рассылки
+RECIPIENTS_CHUNK_SIZE = int(os.getenv('RECIPIENTS_CHUNK_SIZE', 2000))
+# Количество записей журнала доставки, сохраняемых одним запросом
+DELIVERY_LOG_BATCH_SIZE = int(os.getenv('DELIVERY_LOG_BATCH_SIZE', 5000))
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -164,6 +206,51 @@ APSCHEDULER_RUN_NOW_TIMEOUT = 25  # Seconds
 
 NEWSLETTERING_ENABLED = True
 
+# Если включено, планировщик не отправляет письма сам, а ставит их в таблицу исходящих писем,
+# откуда их забирают воркеры python manage.py runoutboxworker
+NEWSLETTER_OUTBOX_ENABLED = os.getenv('NEWSLETTER_OUTBOX_ENABLED', False) == 'True'
+# Количество писем, забираемых воркером за один раз
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 500))
+# Через сколько секунд захваченные, но не отправленные письма (упавший воркер) снова доступны для захвата
+OUTBOX_CLAIM_TIMEOUT = int(os.getenv('OUTBOX_CLAIM_TIMEOUT', 600))
+# Как часто планировщик сам обрабатывает очередь исходящих писем (в том числе повторы), в секундах
+OUTBOX_POLL_INTERVAL = int(os.getenv('OUTBOX_POLL_INTERVAL', 30))
+
+# Повтор отправки при временных ошибках (4xx, разрыв соединения): максимальное количество попыток,
+# начальная и максимальная задержка экспоненциального роста в секундах
+EMAIL_RETRY_MAX_ATTEMPTS = int(os.getenv('EMAIL_RETRY_MAX_ATTEMPTS', 5))
+EMAIL_RETRY_BASE_DELAY = int(os.getenv('EMAIL_RETRY_BASE_DELAY', 60))
+EMAIL_RETRY_MAX_DELAY = int(os.getenv('EMAIL_RETRY_MAX_DELAY', 3600))
+
+# Общее окно доставки в минутах: письма больших рассылок (от NEWSLETTER_DELIVERY_WINDOW_THRESHOLD получателей)
+# ставятся в очередь исходящих равными частями на каждую минуту окна, 0 - без окна
+NEWSLETTER_DELIVERY_WINDOW_MINUTES = int(os.getenv('NEWSLETTER_DELIVERY_WINDOW_MINUTES', 0))
+NEWSLETTER_DELIVERY_WINDOW_THRESHOLD = int(os.getenv('NEWSLETTER_DELIVERY_WINDOW_THRESHOLD', 10000))
+
+# Разбивка времени каждого запуска job_every_minute по этапам (модель JobRunTrace)
+JOB_TRACE_ENABLED = os.getenv('JOB_TRACE_ENABLED', 'True') == 'True'
+# Доля запусков (от 0 до 1), для которых сохраняется профиль cProfile, и папка для файлов профилей
+JOB_TRACE_PROFILE_RATE = float(os.getenv('JOB_TRACE_PROFILE_RATE', 0))
+JOB_TRACE_PROFILE_DIR = os.getenv('JOB_TRACE_PROFILE_DIR', BASE_DIR / 'profiles')
+
+# Как часто процесс сохраняет свои метрики в БД для представления /metrics, в секундах
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 15))
+# Токен для сбора метрик (Prometheus bearer_token), без него /metrics доступен только сотрудникам
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Количество процессов для отправки рассылок, 0 - рассылки отправляются по очереди в процессе планировщика
+NEWSLETTER_PROCESS_POOL_SIZE = int(os.getenv('NEWSLETTER_PROCESS_POOL_SIZE', 0))
+# Рассылки с большим количеством получателей делятся на части такого размера, части отправляются разными процессами
+NEWSLETTER_SHARD_SIZE = int(os.getenv('NEWSLETTER_SHARD_SIZE', 50000))
+
+# Режим планировщика рассылок: interval - проверка готовых рассылок каждую минуту,
+# event - ожидание до ближайшего времени отправки с пробуждением при создании и изменении рассылок
+NEWSLETTER_SCHEDULER_MODE = os.getenv('NEWSLETTER_SCHEDULER_MODE', 'interval')
+# Максимальное время ожидания планировщика в режиме event, в секундах
+NEWSLETTER_SCHEDULER_MAX_SLEEP = int(os.getenv('NEWSLETTER_SCHEDULER_MAX_SLEEP', 3600))
+# Как часто процессы пытаются стать ведущим (запустить планировщик), а ведущий проверяет свою блокировку, в секундах
+NEWSLETTER_LEADER_POLL_INTERVAL = int(os.getenv('NEWSLETTER_LEADER_POLL_INTERVAL', 5))
+
 CACHE_ENABLED = os.getenv('CACHE_ENABLED', False) == 'True'
 if CACHE_ENABLED:
     CACHES = {
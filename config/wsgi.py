@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Планировщик рассылок запускается в процессах веб приложения (в одном ведущем процессе),
+# но не в командах manage.py, которые тоже загружают приложение eservice
+from eservice.apps import start_newslettering  # noqa: E402
+
+start_newslettering()
@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.utils import timezone
 
-from eservice.models import Client, Message, AttemptsNewsletter, Newsletter
+from eservice.models import Client, Message, AttemptsNewsletter, Newsletter, OutboxMessage, DeliveryLog, \
+    SuppressedEmail, SendCheckpoint, JobRunTrace, Attachment
 
 
 @admin.register(Client)
@@ -9,10 +11,16 @@ class ClientAdmin(admin.ModelAdmin):
     list_filter = ('name', 'email')
 
 
+class AttachmentInline(admin.TabularInline):
+    model = Attachment
+    extra = 0
+
+
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('subject', 'body')
     list_filter = ('subject',)
+    inlines = (AttachmentInline,)
 
 
 @admin.register(AttemptsNewsletter)
@@ -46,3 +54,44 @@ class NewsletterAdmin(admin.ModelAdmin):
 
             return readonly_fields
         return tuple()
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('email', 'newsletter', 'date_time_occurrence', 'status', 'date_time_sent')
+    list_filter = ('status',)
+
+
+@admin.register(DeliveryLog)
+class DeliveryLogAdmin(admin.ModelAdmin):
+    list_display = ('email', 'date_time_sent', 'status', 'smtp_code', 'latency_ms')
+    list_filter = ('status', 'smtp_code')
+
+
+@admin.register(SuppressedEmail)
+class SuppressedEmailAdmin(admin.ModelAdmin):
+    list_display = ('email', 'reason', 'is_active', 'updated_at')
+    list_filter = ('reason', 'is_active')
+    search_fields = ('email',)
+
+    # Удаление из админки отключает запись: удаленные строки не видны спискам исключений в памяти воркеров,
+    # которые догружают только изменения по updated_at
+    def delete_model(self, request, obj):
+        obj.is_active = False
+        obj.save(update_fields=['is_active', 'updated_at'])
+
+    def delete_queryset(self, request, queryset):
+        queryset.update(is_active=False, updated_at=timezone.now())
+
+
+@admin.register(SendCheckpoint)
+class SendCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('newsletter', 'date_time_occurrence', 'client_id_from', 'last_client_id', 'is_completed')
+    list_filter = ('is_completed',)
+
+
+@admin.register(JobRunTrace)
+class JobRunTraceAdmin(admin.ModelAdmin):
+    list_display = ('job_id', 'started_at', 'duration', 'profile_path')
+    list_filter = ('job_id',)
+    readonly_fields = ('job_id', 'started_at', 'duration', 'stages', 'profile_path')
@@ -1,19 +1,17 @@
-import os
-from time import sleep
-
 from django.apps import AppConfig
-from django.core.management import call_command
 
 from config.settings import NEWSLETTERING_ENABLED
 
 
 def start_newslettering():
+    """
+    Вызывается при запуске каждого процесса веб приложения (config/wsgi.py, config/asgi.py).
+    Процессов может быть сколько угодно: планировщик работает только в одном из них, выбранном ведущим,
+    при падении ведущего процесса его место занимает другой
+    """
     if NEWSLETTERING_ENABLED:
-        sleep(2)
-        if os.environ.get('RUN_MAIN'):
-            # os.environ.get('RUN_MAIN') рабочий способ для запуска только ОДНОГО планировщика
-            from eservice.services import run_application_scheduler
-            run_application_scheduler()
+        from eservice.services import run_application_scheduler
+        run_application_scheduler()
 
 
 class EserviceConfig(AppConfig):
@@ -21,4 +19,4 @@ class EserviceConfig(AppConfig):
     name = 'eservice'
 
     def ready(self):
-        start_newslettering()
+        import eservice.signals  # noqa: F401
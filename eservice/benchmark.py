@@ -0,0 +1,118 @@
+import os
+import resource
+import threading
+import time
+
+from django.utils import timezone
+
+from eservice.models import Client, Message, Newsletter, DeliveryLog, SuppressedEmail
+
+BENCHMARK_DOMAINS = ("bench-a.example", "bench-b.example", "bench-c.example", "bench-d.example")
+BENCHMARK_BATCH_SIZE = 5000
+
+
+def create_fixtures(recipients, domains=BENCHMARK_DOMAINS, subject="Тестовая рассылка", body="Текст письма") -> Newsletter:
+    """
+    Создает сообщение, ежедневную рассылку, которую пора отправлять, и recipients клиентов на тестовых доменах.
+    Клиенты и связи с рассылкой создаются пачками, поэтому подходит и для сотен тысяч получателей
+    """
+    message = Message.objects.create(subject=subject, body=body)
+    date_time_sent = timezone.now() - timezone.timedelta(minutes=1)
+    newsletter = Newsletter.objects.create(
+        date_time_first_sent=date_time_sent,
+        date_time_next_sent=date_time_sent,
+        period=Newsletter.PERIOD_EVERY_DAY,
+        message=message,
+    )
+
+    through = Newsletter.clients.through
+    for start in range(0, recipients, BENCHMARK_BATCH_SIZE):
+        clients = Client.objects.bulk_create([
+            Client(name=f"Клиент {i}", email=f"client{i}@{domains[i % len(domains)]}")
+            for i in range(start, min(start + BENCHMARK_BATCH_SIZE, recipients))
+        ])
+        through.objects.bulk_create([through(newsletter_id=newsletter.id, client_id=client.id) for client in clients])
+
+    return newsletter
+
+
+def delete_fixtures(newsletter: Newsletter, domains=BENCHMARK_DOMAINS):
+    """Удаляет тестовую рассылку вместе с ее клиентами, журналами и исключенными адресами тестовых доменов"""
+    for domain in domains:
+        Client.objects.filter(email__endswith=f"@{domain}").delete()
+        SuppressedEmail.objects.filter(email__endswith=f"@{domain}").delete()
+    # Рассылка, попытки, журнал доставки и очередь исходящих удаляются вместе с сообщением
+    newsletter.message.delete()
+
+
+def get_latencies_ms(newsletter: Newsletter) -> list[int]:
+    return sorted(DeliveryLog.objects.filter(newsletter=newsletter).values_list("latency_ms", flat=True))
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+
+def get_rss_mb() -> float:
+    """
+    Текущая память процесса. ru_maxrss для замеров не подходит: это пик за всю жизнь процесса,
+    и каждый следующий замер показывал бы пик предыдущих замеров и создания данных
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        # Без /proc (не Linux) остается только пик процесса, в macOS ru_maxrss в байтах
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 / 1024
+
+
+class ResourcesMonitor(threading.Thread):
+    """
+    Фоновый поток, который во время замера раз в interval секунд запоминает
+    наибольшие память и количество потоков процесса
+    """
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_rss_mb = get_rss_mb()
+        self.peak_rss_mb = self.start_rss_mb
+        self.peak_threads = threading.active_count()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        self.peak_rss_mb = max(self.peak_rss_mb, get_rss_mb())
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+
+def measure(run) -> dict:
+    """
+    Выполняет run() и возвращает время выполнения, пиковые за время выполнения память процесса
+    (и ее прирост от начала замера) и количество потоков
+    """
+    monitor = ResourcesMonitor()
+    monitor.start()
+    start_time = time.perf_counter()
+    try:
+        run()
+    finally:
+        seconds = time.perf_counter() - start_time
+        monitor.stop()
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": monitor.peak_rss_mb,
+        "rss_growth_mb": monitor.peak_rss_mb - monitor.start_rss_mb,
+        "peak_threads": monitor.peak_threads,
+    }
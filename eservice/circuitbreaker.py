@@ -0,0 +1,122 @@
+import threading
+import time
+
+from django.conf import settings
+
+# Как часто ожидающие потоки проверяют, закончилось ли пробное подключение, в секундах
+PROBE_WAIT_INTERVAL = 0.05
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения отправки для одного SMTP аккаунта.
+    Закрыт - подключения разрешены. После failure_threshold ошибок подключения или авторизации подряд размыкается,
+    и все получатели пропускаются без попыток подключения. Через reset_timeout секунд переходит в полуоткрытое
+    состояние: разрешается одно пробное подключение, успех замыкает автомат, ошибка снова размыкает его
+    """
+
+    STATE_CLOSED = "CLOSED"
+    STATE_OPEN = "OPEN"
+    STATE_HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.STATE_CLOSED
+        self.failures_count = 0
+        self.last_error = None
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != self.STATE_CLOSED
+
+    def allow_request(self) -> bool:
+        """Можно ли открывать новое соединение. В полуоткрытом состоянии разрешает только одно пробное"""
+        with self._lock:
+            if self.state == self.STATE_CLOSED:
+                return True
+            if self.state == self.STATE_OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.STATE_HALF_OPEN
+            if self.state == self.STATE_HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def is_probing(self) -> bool:
+        """Идет ли пробное подключение: остальным стоит дождаться его результата, а не пропускать получателей"""
+        return self.state == self.STATE_HALF_OPEN and self.probe_in_flight
+
+    def wait_request(self) -> bool:
+        """Как allow_request, но во время пробного подключения дожидается его результата"""
+        allowed = self.allow_request()
+        while not allowed and self.is_probing():
+            time.sleep(PROBE_WAIT_INTERVAL)
+            allowed = self.allow_request()
+        return allowed
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.STATE_CLOSED:
+                print("Подключение к почтовому серверу восстановлено, отправка возобновлена")
+            self.state = self.STATE_CLOSED
+            self.failures_count = 0
+            self.last_error = None
+            self.probe_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures_count += 1
+            self.last_error = error
+            self.probe_in_flight = False
+            if self.state == self.STATE_HALF_OPEN or self.failures_count >= self.failure_threshold:
+                if self.state == self.STATE_CLOSED:
+                    print("Отправка приостановлена:", self.get_reason())
+                self.state = self.STATE_OPEN
+                self.opened_at = time.monotonic()
+
+    def get_state(self) -> dict:
+        """Состояние автомата для передачи между процессами (процесс пула отправки возвращает его родителю)"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures_count": self.failures_count,
+                "last_error": self.last_error,
+                "opened_at": self.opened_at,
+            }
+
+    def set_state(self, state: dict):
+        with self._lock:
+            if self.state == self.STATE_CLOSED and state["state"] != self.STATE_CLOSED:
+                print("Отправка приостановлена в процессе пула:", state["last_error"])
+            self.state = state["state"]
+            self.failures_count = state["failures_count"]
+            self.last_error = state["last_error"]
+            # monotonic в Linux общий для всех процессов хоста, поэтому время размыкания переносится как есть
+            self.opened_at = state["opened_at"]
+            self.probe_in_flight = False
+
+    def get_reason(self) -> str:
+        return f"{self.failures_count} ошибок подключения к почтовому серверу подряд, последняя: {self.last_error}"
+
+    def get_skip_text(self) -> str:
+        return "Отправка приостановлена автоматом отключения: " + self.get_reason()
+
+
+# Как и ограничители скорости, автоматы живут все время работы процесса, чтобы состояние сохранялось между запусками
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(account=None) -> CircuitBreaker:
+    """Возвращает автомат отключения для SMTP аккаунта (по умолчанию EMAIL_HOST_USER)"""
+    account = account or settings.EMAIL_HOST_USER
+    with _circuit_breakers_lock:
+        if account not in _circuit_breakers:
+            _circuit_breakers[account] = CircuitBreaker(
+                failure_threshold=settings.EMAIL_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=settings.EMAIL_CIRCUIT_RESET_TIMEOUT,
+            )
+        return _circuit_breakers[account]
@@ -0,0 +1,95 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from config.settings import NEWSLETTER_PROCESS_POOL_SIZE, NEWSLETTER_SHARD_SIZE
+from eservice.circuitbreaker import get_circuit_breaker, CircuitBreaker
+from eservice.dispatch_worker import init_worker_process, send_shard
+from eservice.metrics import registry
+from eservice.models import Newsletter, SendCheckpoint
+
+
+def get_shards(newsletter, shard_size=NEWSLETTER_SHARD_SIZE) -> list[tuple]:
+    """
+    Делит получателей рассылки на диапазоны идентификаторов клиентов не больше shard_size получателей.
+    Границы диапазонов берутся из таблицы связи рассылки с клиентами и при первом запуске отправки
+    сохраняются сразу для всех частей (отметки прогресса SendCheckpoint с началом диапазона), поэтому остаются
+    неизменными до конца отправки: после падения каждая часть продолжается со своей отметки,
+    а части, которые не успели начаться, отправляются с начала
+    """
+    checkpoints = SendCheckpoint.objects.filter(
+        newsletter=newsletter, date_time_occurrence=newsletter.date_time_next_sent
+    )
+    if not checkpoints.exists():
+        SendCheckpoint.objects.bulk_create(
+            [
+                SendCheckpoint(
+                    newsletter=newsletter,
+                    date_time_occurrence=newsletter.date_time_next_sent,
+                    client_id_from=client_id_from,
+                )
+                for client_id_from in get_shard_bounds(newsletter, shard_size)
+            ],
+            ignore_conflicts=True,
+        )
+
+    bounds = [bound or None for bound in sorted(checkpoints.values_list("client_id_from", flat=True))] + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def get_shard_bounds(newsletter, shard_size) -> list[int]:
+    """Начала диапазонов клиентов частей рассылки, первая часть начинается с 0"""
+    client_ids = Newsletter.clients.through.objects.filter(newsletter_id=newsletter.id).order_by("client_id")
+    count = client_ids.count()
+    bounds = [0]
+    for offset in range(shard_size, count, shard_size):
+        bounds.append(client_ids.values_list("client_id", flat=True)[offset])
+    return bounds
+
+
+def merge_operation_results(operation_results) -> tuple:
+    """Общий результат рассылки по результатам ее частей, по тем же правилам, что и make_operation_result"""
+    send_time = min(operation_result[0] for operation_result in operation_results)
+    for operation_result in operation_results:
+        if operation_result[1]:
+            return send_time, True, "OK"
+    return send_time, False, operation_results[0][2]
+
+
+def send_in_processes(newsletters, pool_size=NEWSLETTER_PROCESS_POOL_SIZE) -> dict:
+    """
+    Отправляет рассылки в пуле процессов: каждая рассылка, а большая рассылка - каждая ее часть, уходит
+    отдельной задачей. У каждого процесса свои соединения с БД и пул SMTP соединений, поэтому используются все ядра.
+    Процессы пула создаются на каждый запуск: пределы скорости аккаунта делятся между ними,
+    а состояние автомата отключения после отправки переносится в этот процесс.
+    Возвращает результаты отправки по идентификатору рассылки
+    """
+    tasks = [(newsletter.id, *shard) for newsletter in newsletters for shard in get_shards(newsletter)]
+    if not tasks:
+        return {}
+    process_count = min(pool_size, len(tasks))
+
+    # Процесс планировщика многопоточный (потоки APScheduler, выбора ведущего, LISTEN), а блокировки
+    # ограничителя скорости и автомата отключения общие для процесса. Процесс, созданный через fork,
+    # может получить копию захваченной другим потоком блокировки и зависнуть, а также унаследует сокеты
+    # соединений с БД, поэтому процессы пула запускаются через spawn
+    shard_results = {}
+    circuit_breaker_states = []
+    with ProcessPoolExecutor(max_workers=process_count, initializer=init_worker_process, initargs=(process_count,),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(send_shard, *task) for task in tasks]
+        for future in futures:
+            newsletter_id, operation_result, metrics, circuit_breaker_state = future.result()
+            registry.merge(metrics)
+            shard_results.setdefault(newsletter_id, []).append(operation_result)
+            circuit_breaker_states.append(circuit_breaker_state)
+
+    # Если автомат разомкнулся хотя бы в одном процессе, он размыкается и здесь (с последним временем размыкания):
+    # пока он не замкнется, запуски отправляют рассылки в этом процессе, без новых процессов пула
+    open_states = [state for state in circuit_breaker_states if state["state"] != CircuitBreaker.STATE_CLOSED]
+    if open_states:
+        get_circuit_breaker().set_state(max(open_states, key=lambda state: state["opened_at"]))
+
+    return {
+        newsletter_id: merge_operation_results(operation_results)
+        for newsletter_id, operation_results in shard_results.items()
+    }
@@ -0,0 +1,37 @@
+import django
+
+# Задачи процессов пула отправки. Процессы запускаются через spawn, и этот модуль импортируется в них
+# до настройки Django, поэтому модули приложения (модели и т.д.) импортируются только внутри функций
+
+
+def init_worker_process(process_count=1):
+    """
+    Инициализация процесса пула: Django настраивается заново, соединения с БД процесс открывает свои.
+    Пределы скорости аккаунта делятся между process_count процессами пула
+    """
+    django.setup()
+
+    from eservice.ratelimit import set_process_count
+
+    set_process_count(process_count)
+
+
+def send_shard(newsletter_id, client_id_from=None, client_id_to=None):
+    """
+    Отправка части рассылки (клиенты с client_id_from включительно до client_id_to) в процессе пула.
+    Вместе с результатом возвращает метрики, накопленные при отправке, и состояние автомата отключения,
+    их учитывает родительский процесс
+    """
+    from django.db import connections
+
+    from eservice.circuitbreaker import get_circuit_breaker
+    from eservice.email import send
+    from eservice.metrics import registry
+    from eservice.models import Newsletter
+
+    newsletter = Newsletter.objects.select_related("message").get(id=newsletter_id)
+    try:
+        operation_result = send(newsletter, (client_id_from, client_id_to))
+        return newsletter_id, operation_result, registry.collect(reset=True), get_circuit_breaker().get_state()
+    finally:
+        connections.close_all()
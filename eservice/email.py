@@ -1,72 +1,543 @@
+import asyncio
+import queue
 import threading
-from smtplib import SMTPAuthenticationError, SMTPException
+import time
+from collections import namedtuple
+from smtplib import SMTPAuthenticationError, SMTPException, SMTPServerDisconnected, SMTPSenderRefused, \
+    SMTPRecipientsRefused, SMTPDataError
 
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.db import transaction
 from django.utils import timezone
+from django.utils.module_loading import import_string
 
-from config.settings import EMAIL_HOST_USER
-from eservice.models import Newsletter
+from config.settings import EMAIL_SEND_POOL_SIZE, EMAIL_MESSAGES_PER_CONNECTION, EMAIL_SEND_MODE, \
+    EMAIL_ASYNC_CONCURRENCY, RECIPIENTS_CHUNK_SIZE
+from eservice.circuitbreaker import get_circuit_breaker, PROBE_WAIT_INTERVAL
+from eservice.metrics import SMTP_CONNECT_SECONDS, record_results
+from eservice.mime import PreparedMessage, get_prepared_message
+from eservice.models import Newsletter, DeliveryLog, OutboxMessage, SuppressedEmail, SendCheckpoint
+from eservice.planner import plan_dispatch
+from eservice.ratelimit import get_rate_limiter
+from eservice.suppression import get_suppression_list
+from eservice.tracing import span
 
+SEND_MODE_POOL = "pool"
+SEND_MODE_ASYNCIO = "asyncio"
 
-class EmailThread(threading.Thread):
-    def __init__(self, subject, html_content, recipient_list):
-        self.subject = subject
-        self.recipient_list = recipient_list
-        self.html_content = html_content
-        self.operation_completed = False
-        self.operation_text = ""
+# Код ответа SMTP сервера на успешно принятое письмо
+SMTP_CODE_OK = 250
+
+# Получатель письма: идентификатор клиента, адрес и Ф. И. О. для подстановки в сообщение
+Recipient = namedtuple("Recipient", ("client_id", "email", "name"))
+
+# План отправки рассылки: отметка прогресса и получатели (None - получатели читаются при отправке)
+NewsletterPlan = namedtuple("NewsletterPlan", ("checkpoint", "recipients"))
+
+
+class SendResult:
+    """
+    Результат отправки письма одному получателю: статус, код ответа SMTP сервера, время отправки в секундах,
+    признак временной ошибки, после которой отправку стоит повторить,
+    и признак отказа сервера именно в получателе (а не в отправителе или соединении)
+    """
+
+    __slots__ = ("email", "client_id", "operation_completed", "operation_text", "smtp_code", "latency", "transient",
+                 "bounced")
+
+    def __init__(self, email, client_id=None, operation_completed=False, operation_text="", smtp_code=None,
+                 latency=0.0, transient=False, bounced=False):
+        self.email = email
+        self.client_id = client_id
+        self.operation_completed = operation_completed
+        self.operation_text = operation_text
+        self.smtp_code = smtp_code
+        self.latency = latency
+        self.transient = transient
+        self.bounced = bounced
+
+    def set_error(self, text, error=None):
+        self.operation_text = text
+        if error is not None:
+            self.smtp_code = get_smtp_code(error)
+            self.transient = is_transient_error(error)
+            # smtplib и aiosmtplib сообщают об отказе в получателе исключениями с полем recipients или recipient
+            self.bounced = hasattr(error, "recipients") or hasattr(error, "recipient")
+
+
+def get_smtp_code(error):
+    """Достает код ответа SMTP сервера из исключения smtplib или aiosmtplib, если он есть"""
+    code = getattr(error, "smtp_code", None) or getattr(error, "code", None)
+    if code is None:
+        # Отказ в получателях: smtplib хранит словарь {адрес: (код, ответ)}, aiosmtplib - список исключений
+        recipients = getattr(error, "recipients", None)
+        if isinstance(recipients, dict) and recipients:
+            code = next(iter(recipients.values()))[0]
+        elif isinstance(recipients, list) and recipients:
+            code = getattr(recipients[0], "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_transient_error(error) -> bool:
+    """
+    Временная ли ошибка отправки: коды 4xx - временный отказ сервера, 5xx - постоянный.
+    Ошибки без кода ответа (разрыв соединения, таймаут, отказ в подключении) тоже считаются временными
+    """
+    code = get_smtp_code(error)
+    if code is not None:
+        return 400 <= code < 500
+    return isinstance(error, OSError)
+
+
+def send_chunks(smtp, from_addr, to_addr, chunks):
+    """
+    Отправка письма частями через открытое соединение smtplib, аналог smtp.sendmail для одного получателя.
+    Части (в том числе общие буферы вложений) пишутся в сокет как есть, без склейки письма в один объект
+    """
+    code, response = smtp.mail(from_addr)
+    if code != SMTP_CODE_OK:
+        smtp.rset()
+        raise SMTPSenderRefused(code, response, from_addr)
+    code, response = smtp.rcpt(to_addr)
+    if code not in (250, 251):
+        smtp.rset()
+        raise SMTPRecipientsRefused({to_addr: (code, response)})
+
+    smtp.putcmd("data")
+    code, response = smtp.getreply()
+    if code != 354:
+        smtp.rset()
+        raise SMTPDataError(code, response)
+    for chunk in chunks:
+        smtp.sock.sendall(chunk)
+    smtp.send(b".\r\n")
+    code, response = smtp.getreply()
+    if code != SMTP_CODE_OK:
+        raise SMTPDataError(code, response)
+
+
+def chunked(iterable, size):
+    """Разбивает последовательность на списки не длиннее size"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class EmailWorker(threading.Thread):
+    """
+    Поток пула отправки. Забирает из очереди пачки получателей и отправляет их через
+    постоянное SMTP соединение, которое переоткрывается каждые messages_per_connection писем
+    """
+
+    def __init__(self, tasks: queue.Queue, results: list, messages_per_connection: int, rate_limiter=None,
+                 circuit_breaker=None):
+        self.tasks = tasks
+        self.results = results
+        self.messages_per_connection = messages_per_connection
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.connection = None
+        self.connection_sent = 0
         threading.Thread.__init__(self)
 
     def run(self):
         try:
-            send_mail(
-                self.subject,
-                self.html_content,
-                EMAIL_HOST_USER,
-                self.recipient_list,
-                fail_silently=False,
-            )
-            self.operation_completed = True
-        except SMTPAuthenticationError:
-            self.operation_text = "Не удалось авторизоваться на почте"
-        except SMTPException as e:
-            self.operation_text = "SMTPException " + str(e)
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    break
+                prepared, recipients = task
+                self.results.extend(self.send_batch(prepared, recipients))
+        finally:
+            self.close_connection()
+
+    def send_batch(self, prepared: PreparedMessage, recipients) -> list[SendResult]:
+        batch_results = []
+        for recipient in recipients:
+            result = SendResult(recipient.email, recipient.client_id)
+            if self.connection is None and self.circuit_breaker is not None \
+                    and not self.circuit_breaker.wait_request():
+                # Сервер недоступен: получатель пропускается сразу, без подключения и ожидания
+                result.set_error(self.circuit_breaker.get_skip_text(), self.circuit_breaker.last_error)
+                batch_results.append(result)
+                continue
+            if self.rate_limiter is not None:
+                # Ожидание ограничения скорости не входит во время отправки письма
+                self.rate_limiter.acquire(recipient.email)
+            start_time = time.monotonic()
+            try:
+                connection = self.get_connection()
+                if isinstance(connection, SMTPEmailBackend) and prepared.streamed:
+                    # Письмо с вложениями уходит частями: файлы передаются из общих буферов без копирования
+                    send_chunks(
+                        connection.connection,
+                        prepared.envelope_from,
+                        prepared.get_envelope_recipient(recipient.email),
+                        prepared.get_smtp_chunks(recipient),
+                    )
+                elif isinstance(connection, SMTPEmailBackend):
+                    # Готовые байты письма отправляются напрямую через открытое SMTP соединение
+                    connection.connection.sendmail(
+                        prepared.envelope_from,
+                        [prepared.get_envelope_recipient(recipient.email)],
+                        prepared.as_bytes(recipient),
+                    )
+                else:
+                    # Прочие бэкенды (консоль, файлы, память) получают обычное письмо Django.
+                    # Соединение уже открыто, поэтому send_messages не закрывает его после отправки
+                    connection.send_messages([prepared.as_email_message(recipient)])
+                self.connection_sent += 1
+                result.operation_completed = True
+                result.smtp_code = SMTP_CODE_OK
+            except SMTPAuthenticationError as e:
+                result.set_error("Не удалось авторизоваться на почте", e)
+                self.close_connection()
+            except SMTPServerDisconnected as e:
+                result.set_error("SMTPException " + str(e), e)
+                self.close_connection()
+            except SMTPException as e:
+                result.set_error("SMTPException " + str(e), e)
+            except Exception as e:
+                result.set_error("Exception " + str(e), e)
+                self.close_connection()
+            result.latency = time.monotonic() - start_time
+            batch_results.append(result)
+        return batch_results
+
+    def get_connection(self):
+        if self.connection is not None and self.connection_sent >= self.messages_per_connection:
+            self.close_connection()
+        if self.connection is None:
+            connection = get_connection(fail_silently=False)
+            start_time = time.monotonic()
+            try:
+                connection.open()
+            except Exception as e:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record_failure(e)
+                raise
+            SMTP_CONNECT_SECONDS.observe(time.monotonic() - start_time)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_success()
+            self.connection = connection
+            self.connection_sent = 0
+        return self.connection
+
+    def close_connection(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class EmailSenderPool:
+    """
+    Пул потоков отправки фиксированного размера.
+    Вместо потока на каждого получателя, получатели раздаются пачками через ограниченную очередь
+    """
+
+    def __init__(self, pool_size=EMAIL_SEND_POOL_SIZE, messages_per_connection=EMAIL_MESSAGES_PER_CONNECTION):
+        self.pool_size = max(1, pool_size)
+        self.messages_per_connection = max(1, messages_per_connection)
+
+    def send_groups(self, prepared: PreparedMessage, groups) -> list[SendResult]:
+        """
+        Отправляет группы получателей: каждая группа целиком уходит одному потоку и одному соединению
+        (группы длиннее messages_per_connection делятся)
+        """
+        tasks = queue.Queue(maxsize=self.pool_size * 2)
+        results = []
+        rate_limiter = get_rate_limiter()
+        circuit_breaker = get_circuit_breaker()
+        workers = [
+            EmailWorker(tasks, results, self.messages_per_connection, rate_limiter, circuit_breaker)
+            for _ in range(self.pool_size)
+        ]
+        [worker.start() for worker in workers]
+
+        try:
+            for group in groups:
+                for chunk in chunked(group, self.messages_per_connection):
+                    tasks.put((prepared, chunk))
+        finally:
+            [tasks.put(None) for _ in workers]
+            [worker.join() for worker in workers]
+
+        return results
+
+
+class AsyncEmailSender:
+    """
+    Отправка рассылки в одном цикле событий asyncio через асинхронный SMTP клиент (aiosmtplib).
+    Каждая SMTP сессия отправляет до messages_per_connection писем,
+    количество одновременно открытых сессий ограничено семафором
+    """
+
+    def __init__(self, concurrency=EMAIL_ASYNC_CONCURRENCY, messages_per_connection=EMAIL_MESSAGES_PER_CONNECTION):
+        self.concurrency = max(1, concurrency)
+        self.messages_per_connection = max(1, messages_per_connection)
+
+    def send_groups(self, prepared: PreparedMessage, groups) -> list[SendResult]:
+        """Отправляет группы получателей, каждая группа (не длиннее messages_per_connection) - одна SMTP сессия"""
+        return asyncio.run(self.send_all(prepared, groups))
+
+    async def send_all(self, prepared: PreparedMessage, groups) -> list[SendResult]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = []
+        sessions = set()
+
+        async def run_session(chunk):
+            try:
+                results.extend(await self.send_session(prepared, chunk))
+            except Exception as e:
+                # Ошибка до отправки писем сессии не должна прерывать остальные сессии (как и в пуле потоков)
+                session_results = [SendResult(recipient.email, recipient.client_id) for recipient in chunk]
+                results.extend(self.fail_all(session_results, "Exception " + str(e), e))
+            finally:
+                semaphore.release()
+
+        for group in groups:
+            for chunk in chunked(group, self.messages_per_connection):
+                # Новая сессия создается только при наличии свободного места под семафором
+                await semaphore.acquire()
+                session = asyncio.create_task(run_session(chunk))
+                sessions.add(session)
+                session.add_done_callback(sessions.discard)
+
+        if sessions:
+            await asyncio.gather(*sessions)
+        return results
+
+    async def send_session(self, prepared: PreparedMessage, recipients) -> list[SendResult]:
+        import aiosmtplib
+
+        session_results = [SendResult(recipient.email, recipient.client_id) for recipient in recipients]
+        rate_limiter = get_rate_limiter()
+        circuit_breaker = get_circuit_breaker()
+        allowed = circuit_breaker.allow_request()
+        while not allowed and circuit_breaker.is_probing():
+            await asyncio.sleep(PROBE_WAIT_INTERVAL)
+            allowed = circuit_breaker.allow_request()
+        if not allowed:
+            return self.fail_all(session_results, circuit_breaker.get_skip_text(), circuit_breaker.last_error)
+
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.EMAIL_HOST,
+            port=int(settings.EMAIL_PORT) if settings.EMAIL_PORT else None,
+            username=settings.EMAIL_HOST_USER or None,
+            password=settings.EMAIL_HOST_PASSWORD or None,
+            use_tls=settings.EMAIL_USE_SSL,
+            start_tls=settings.EMAIL_USE_TLS,
+            timeout=settings.EMAIL_TIMEOUT,
+        )
+        start_time = time.monotonic()
+        try:
+            await smtp.connect()
+        except aiosmtplib.SMTPAuthenticationError as e:
+            circuit_breaker.record_failure(e)
+            return self.fail_all(session_results, "Не удалось авторизоваться на почте", e)
+        except aiosmtplib.SMTPException as e:
+            circuit_breaker.record_failure(e)
+            return self.fail_all(session_results, "SMTPException " + str(e), e)
         except Exception as e:
-            self.operation_text = "Exception " + str(e)
+            circuit_breaker.record_failure(e)
+            return self.fail_all(session_results, "Exception " + str(e), e)
+        SMTP_CONNECT_SECONDS.observe(time.monotonic() - start_time)
+        circuit_breaker.record_success()
 
+        try:
+            for recipient, result in zip(recipients, session_results):
+                wait = rate_limiter.reserve(recipient.email)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                start_time = time.monotonic()
+                try:
+                    envelope_recipient = prepared.get_envelope_recipient(recipient.email)
+                    message = prepared.as_bytes(recipient)
+                except Exception as e:
+                    # Письмо не собралось (адрес, подстановка): соединение не затронуто, сессия продолжается
+                    result.set_error("Exception " + str(e), e)
+                    result.latency = time.monotonic() - start_time
+                    continue
+                try:
+                    await smtp.sendmail(prepared.envelope_from, [envelope_recipient], message)
+                    result.operation_completed = True
+                    result.smtp_code = SMTP_CODE_OK
+                except aiosmtplib.SMTPServerDisconnected as e:
+                    result.set_error("SMTPException " + str(e), e)
+                    break
+                except aiosmtplib.SMTPException as e:
+                    result.set_error("SMTPException " + str(e), e)
+                except Exception as e:
+                    # Состояние SMTP сессии неизвестно, оставшиеся получатели отправляются повторно
+                    result.set_error("Exception " + str(e), e)
+                    break
+                finally:
+                    result.latency = time.monotonic() - start_time
+        finally:
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
 
-def send_mail_async(subject, html_content, recipient_list):
-    EmailThread(subject, html_content, recipient_list).start()
+        # Если соединение было разорвано, оставшиеся получатели помечаются временной ошибкой
+        return self.fail_all(session_results, "SMTPException Соединение разорвано", ConnectionError())
 
+    @staticmethod
+    def fail_all(results: list[SendResult], text, error=None) -> list[SendResult]:
+        for result in results:
+            if not result.operation_completed and not result.operation_text:
+                result.set_error(text, error)
+        return results
 
-def send(newsletter: Newsletter):
-    send_time = timezone.now()
 
-    clients = newsletter.clients.get_queryset()
+def get_sender(prepared: PreparedMessage):
+    """
+    Возвращает движок отправки письма prepared согласно настройке EMAIL_SEND_MODE.
+    Письма с вложениями всегда отправляет пул потоков: aiosmtplib принимает письмо для DATA только целиком,
+    то есть каждой сессии пришлось бы склеивать свою копию вложений, а пул передает их частями из общих буферов.
+    Режим asyncio подключается к EMAIL_HOST напрямую, поэтому с другими почтовыми бэкендами
+    (консоль, файлы, память при разработке) тоже используется пул, который отправляет через EMAIL_BACKEND
+    """
+    if EMAIL_SEND_MODE == SEND_MODE_ASYNCIO and not prepared.streamed \
+            and issubclass(import_string(settings.EMAIL_BACKEND), SMTPEmailBackend):
+        return AsyncEmailSender()
+    return EmailSenderPool()
 
-    email_threads = []
+
+def iter_recipients(newsletter: Newsletter, client_id_range=None, after_client_id=None,
+                    chunk_size=RECIPIENTS_CHUNK_SIZE):
+    """
+    Поток получателей рассылки без адресов из списка исключений. Из БД читаются только нужные поля,
+    пачками по chunk_size строк через серверный курсор, поэтому все клиенты рассылки не загружаются в память.
+    client_id_range - диапазон (от включительно, до не включительно) идентификаторов клиентов
+    для отправки части рассылки, None на месте границы - без ограничения.
+    after_client_id - продолжение прерванной отправки: только клиенты после уже отправленного
+    """
+    suppression_list = get_suppression_list()
+    clients = newsletter.clients.order_by("id")
+    if after_client_id is not None:
+        clients = clients.filter(id__gt=after_client_id)
+    if client_id_range is not None:
+        client_id_from, client_id_to = client_id_range
+        if client_id_from is not None:
+            clients = clients.filter(id__gte=client_id_from)
+        if client_id_to is not None:
+            clients = clients.filter(id__lt=client_id_to)
+    clients = clients.values_list("id", "email", "name").iterator(chunk_size=chunk_size)
     for client in clients:
-        email_threads.append(EmailThread(newsletter.message.subject, newsletter.message.body, [client.email]))
+        if client[1] not in suppression_list:
+            yield Recipient(*client)
+
+
+def build_send_plan(newsletters, max_recipients=RECIPIENTS_CHUNK_SIZE) -> dict[int, NewsletterPlan]:
+    """
+    План отправки рассылок запуска, ключ - идентификатор рассылки. Отметки прогресса всех рассылок читаются
+    одним запросом, получатели всех небольших рассылок (не больше max_recipients, то есть не больше одной пачки
+    отправки) - одним потоковым запросом по связующей таблице, вместо отдельных запросов на каждую рассылку.
+    Количество получателей берется из аннотации recipients_count, получатели больших рассылок в план не входят
+    и читаются при отправке потоком через iter_recipients
+    """
+    checkpoints = SendCheckpoint.get_for_newsletters(newsletters)
+    recipients = {
+        newsletter.id: [] for newsletter in newsletters
+        if newsletter.recipients_count <= max_recipients
+    }
+    if recipients:
+        suppression_list = get_suppression_list()
+        rows = Newsletter.clients.through.objects.filter(newsletter_id__in=recipients.keys()).order_by(
+            "newsletter_id", "client_id"
+        ).values_list("newsletter_id", "client_id", "client__email", "client__name")
+        for newsletter_id, client_id, email, name in rows.iterator(chunk_size=RECIPIENTS_CHUNK_SIZE):
+            if email not in suppression_list:
+                recipients[newsletter_id].append(Recipient(client_id, email, name))
 
-    print("Send started")
-    [email_thread.start() for email_thread in email_threads]
-    [email_thread.join() for email_thread in email_threads]
+    return {
+        newsletter.id: NewsletterPlan(checkpoints[newsletter.id], recipients.get(newsletter.id))
+        for newsletter in newsletters
+    }
+
+
+def send(newsletter: Newsletter, client_id_range=None, plan: NewsletterPlan = None):
+    """
+    Отправка рассылки (или части client_id_range). plan - отметка прогресса и получатели из плана отправки
+    build_send_plan, без него они читаются из БД
+    """
+    send_time = timezone.now()
+    client_id_from = client_id_range[0] if client_id_range else None
+    checkpoint = plan.checkpoint if plan is not None else SendCheckpoint.get_for(newsletter, client_id_from)
+    if checkpoint.is_completed:
+        # Процесс упал после отправки, но до сдвига времени рассылки: повторно не отправляем
+        print("Send already completed")
+        return checkpoint.get_operation_result()
+
+    print("Send started" if checkpoint.last_client_id is None else f"Send resumed after {checkpoint.last_client_id}")
+    with span("prepare_message"):
+        prepared = get_prepared_message(newsletter.message)
+    sender = get_sender(prepared)
+    if plan is not None and plan.recipients is not None:
+        recipients = (
+            recipient for recipient in plan.recipients
+            if checkpoint.last_client_id is None or recipient.client_id > checkpoint.last_client_id
+        )
+    else:
+        recipients = iter_recipients(newsletter, client_id_range, checkpoint.last_client_id)
+    chunks = chunked(recipients, RECIPIENTS_CHUNK_SIZE)
+    with span("load_recipients"):
+        chunk = next(chunks, None)
+    # Пачка получателей отправляется целиком, после чего ее результаты и отметка прогресса сохраняются вместе.
+    # Следующая пачка читается до сохранения, чтобы отметка последней пачки сразу отмечала отправку завершенной
+    while chunk is not None:
+        with span("plan_dispatch"):
+            groups = plan_dispatch(chunk)
+        # Подстановка полей для каждого получателя выполняется потоками отправки и входит в этот этап
+        with span("smtp_send"):
+            results = sender.send_groups(prepared, groups)
+        record_results(results)
+        with span("load_recipients"):
+            next_chunk = next(chunks, None)
+        with span("save_results"), transaction.atomic():
+            DeliveryLog.save_results(newsletter, send_time, results)
+            SuppressedEmail.suppress_bounces(results)
+            # Временные ошибки (4xx, разрывы соединения) повторяются через очередь исходящих писем
+            OutboxMessage.schedule_retries(newsletter, newsletter.date_time_next_sent, results)
+            checkpoint.add_chunk_result(chunk[-1].client_id, make_operation_result(results), next_chunk is None)
+        chunk = next_chunk
+    if not checkpoint.is_completed:
+        # Получателей не было (или не осталось после прерванной отправки)
+        checkpoint.complete()
     print("Send competed")
 
-    res = make_operation_result(email_threads)
+    res = checkpoint.get_operation_result()
     print(res)
-    return send_time, res[0], res[1]
-    # send_mail_async(newsletter.message.subject, newsletter.message.body, [client.email])
+    return res
 
 
-def make_operation_result(email_threads: list[EmailThread]) -> tuple[bool, str]:
+def make_operation_result(results: list[SendResult]) -> tuple[bool, str]:
     # По тз сказано, что у одной попытки рассылки должна быть одна запись в БД, без привязки к количеству клиентов
     # Поэтому сделан такой алгоритм
 
+    # Рассылка без получателей ничего не отправила
+    if not results:
+        return False, "Нет получателей"
+
     # Если все в ошибках, то берем сообщение первого
-    is_all_in_error = all([not email_thread.operation_completed for email_thread in email_threads])
+    is_all_in_error = all([not result.operation_completed for result in results])
     if is_all_in_error:
-        return False, email_threads[0].operation_text
+        # Если отправка приостановлена автоматом отключения, в попытке сохраняется причина приостановки
+        circuit_breaker = get_circuit_breaker()
+        if circuit_breaker.is_open:
+            return False, circuit_breaker.get_skip_text()
+        return False, results[0].operation_text
     # Если хотя-бы один без ошибки, то записываем успешную отправку
     else:
         return True, "OK"
@@ -0,0 +1,70 @@
+import threading
+from time import sleep
+
+from django.conf import settings
+from django.db import connections
+
+# Ключ рекомендательной блокировки PostgreSQL, которую держит ведущий процесс (процесс с планировщиком)
+SCHEDULER_LOCK_ID = 2_024_070_001
+
+
+class LeaderElection(threading.Thread):
+    """
+    Выбор одного ведущего процесса среди всех процессов приложения (воркеров gunicorn/uwsgi на любых хостах)
+    через рекомендательную блокировку PostgreSQL на отдельном соединении.
+    Остальные процессы пытаются взять блокировку каждые NEWSLETTER_LEADER_POLL_INTERVAL секунд:
+    блокировка освобождается вместе с соединением, поэтому после падения ведущего процесса его место
+    занимает другой. Ведущий с тем же интервалом проверяет, что блокировка у него.
+    start_leading вызывается при получении лидерства и возвращает функцию остановки, которая вызывается при его потере
+    """
+
+    def __init__(self, start_leading, lock_id=SCHEDULER_LOCK_ID):
+        super().__init__(daemon=True, name="leader-election")
+        self.start_leading = start_leading
+        self.lock_id = lock_id
+        self.poll_interval = settings.NEWSLETTER_LEADER_POLL_INTERVAL
+
+    def run(self):
+        while True:
+            lock_connection = connections.create_connection("default")
+            try:
+                if lock_connection.vendor != "postgresql":
+                    # Рекомендательных блокировок нет (SQLite при разработке), ведущим считается этот процесс
+                    print("Выбор ведущего процесса доступен только для PostgreSQL, планировщик запускается сразу")
+                    self.start_leading()
+                    threading.Event().wait()
+                self.wait_lock(lock_connection)
+                print("Процесс выбран ведущим, запуск планировщика...")
+                self.lead(lock_connection)
+            except Exception as e:
+                print("Ошибка выбора ведущего процесса:", e)
+                sleep(self.poll_interval)
+            finally:
+                lock_connection.close()
+
+    def wait_lock(self, lock_connection):
+        with lock_connection.cursor() as cursor:
+            while True:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.lock_id])
+                if cursor.fetchone()[0]:
+                    return
+                sleep(self.poll_interval)
+
+    def lead(self, lock_connection):
+        stop_leading = self.start_leading()
+        try:
+            while self.has_lock(lock_connection):
+                sleep(self.poll_interval)
+        finally:
+            # Соединение оборвалось или блокировка снята: ведущим уже может быть другой процесс
+            print("Процесс больше не ведущий, остановка планировщика")
+            stop_leading()
+
+    def has_lock(self, lock_connection) -> bool:
+        with lock_connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid() "
+                "AND objid = %s AND granted",
+                [self.lock_id],
+            )
+            return cursor.fetchone()[0] > 0
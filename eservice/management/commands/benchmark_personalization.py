@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from eservice.email import Recipient
+from eservice.mime import PersonalizedMessage
+from eservice.personalization import Personalizer
+
+SUBJECT = "{{ name }}, новые предложения недели"
+BODY = """Здравствуйте, {{ name }}!
+
+Подготовили для вас подборку предложений этой недели.
+Письмо отправлено на адрес {{ email }}.
+
+Отписаться от рассылки: {{ unsubscribe_url }}
+"""
+
+
+class Command(BaseCommand):
+    help = "Measures personalization speed: renders/sec and full messages/sec."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipients", type=int, default=100_000, help="Количество получателей")
+
+    def handle(self, *args, **options):
+        count = options["recipients"]
+        recipients = [Recipient(i, f"client{i}@example.com", f"Клиент Номер {i}") for i in range(count)]
+
+        start_time = time.perf_counter()
+        personalizer = Personalizer(SUBJECT, BODY)
+        rendered = sum(1 for _ in personalizer.render_batch(recipients))
+        self.report("Отрисовка темы и тела", rendered, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        message = PersonalizedMessage(SUBJECT.replace("{{ name }}, ", ""), BODY)
+        built = sum(1 for recipient in recipients if message.as_bytes(recipient))
+        self.report("Готовое письмо (тема без подстановки)", built, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        message = PersonalizedMessage(SUBJECT, BODY)
+        built = sum(1 for recipient in recipients if message.as_bytes(recipient))
+        self.report("Готовое письмо (тема с подстановкой)", built, time.perf_counter() - start_time)
+
+    def report(self, title, count, seconds):
+        self.stdout.write(f"{title}: {count} за {seconds:.2f} с, {count / seconds:.0f} в секунду")
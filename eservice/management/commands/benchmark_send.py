@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from config.settings import EMAIL_SEND_MODE
+from eservice.benchmark import create_fixtures, delete_fixtures, get_latencies_ms, measure, percentile
+from eservice.email import send
+from eservice.models import Newsletter
+from eservice.services import job_every_minute
+from eservice.smtp_sink import SMTPSink
+
+ENTRY_SEND = "send"
+ENTRY_JOB = "job"
+
+
+class Command(BaseCommand):
+    help = ("Measures end-to-end sending throughput against a local SMTP sink: msgs/sec, p50/p99 latency, "
+            "peak RSS and threads. Creates and deletes its own fixtures, run it against a test database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipients", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                            help="Количество получателей, по замеру на каждое значение")
+        parser.add_argument("--entry", choices=[ENTRY_SEND, ENTRY_JOB], nargs="+", default=[ENTRY_SEND, ENTRY_JOB],
+                            help="Точка входа: eservice.email.send или задача планировщика job_every_minute")
+        parser.add_argument("--latency", type=float, default=0.0, help="Задержка сервера на письмо, в секундах")
+        parser.add_argument("--failure-rate", type=float, default=0.0,
+                            help="Доля получателей, отклоняемых сервером, от 0 до 1")
+        parser.add_argument("--failure-reply", default="451 4.7.1 Try again later", help="Ответ сервера при отказе")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Движок отправки: {EMAIL_SEND_MODE}")
+        with SMTPSink(keep_messages=False, latency=options["latency"], failure_rate=options["failure_rate"],
+                      failure_reply=options["failure_reply"], seed=0) as sink:
+            with override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+                EMAIL_HOST=sink.host,
+                EMAIL_PORT=sink.port,
+                EMAIL_USE_SSL=False,
+                EMAIL_USE_TLS=False,
+            ):
+                for recipients in options["recipients"]:
+                    for entry in options["entry"]:
+                        self.run_benchmark(sink, entry, recipients)
+
+    def run_benchmark(self, sink, entry, recipients):
+        title = f"{entry}, {recipients} получателей"
+        if entry == ENTRY_JOB and settings.NEWSLETTER_OUTBOX_ENABLED:
+            self.stdout.write(f"{title}: пропущено, задача только ставит письма в очередь исходящих")
+            return
+        if entry == ENTRY_JOB and Newsletter.get_newsletters_ready_to_sent():
+            # Задача отправила бы и чужие рассылки, а результат смешался бы с ними
+            self.stdout.write(f"{title}: пропущено, в БД есть другие рассылки к отправке")
+            return
+
+        newsletter = create_fixtures(recipients)
+        received_count = sink.received_count
+        try:
+            run = job_every_minute if entry == ENTRY_JOB else lambda: send(newsletter)
+            stats = measure(run)
+            latencies = get_latencies_ms(newsletter)
+        finally:
+            delete_fixtures(newsletter)
+
+        sent = sink.received_count - received_count
+        self.stdout.write(
+            f"{title}: отправлено {sent} за {stats['seconds']:.2f} с, {sent / stats['seconds']:.0f} писем/с, "
+            f"p50 {percentile(latencies, 50)} мс, p99 {percentile(latencies, 99)} мс, "
+            f"пик RSS {stats['peak_rss_mb']:.0f} МБ (+{stats['rss_growth_mb']:.0f} МБ за замер), "
+            f"пик потоков {stats['peak_threads']}"
+        )
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from eservice.reschedule import RESCHEDULE_CHUNK_SIZE, reschedule, verify_reschedule
+
+
+class Command(BaseCommand):
+    help = ("Recomputes date_time_next_sent of newsletters in the database in chunks (for example after an outage "
+            "or a time correction). Gives the same result as Newsletter.set_next_sent_datetime.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true",
+                            help="Пересчитать все периодические рассылки, включая завершенные")
+        parser.add_argument("--chunk-size", type=int, default=RESCHEDULE_CHUNK_SIZE,
+                            help="Количество id рассылок, обновляемых одним запросом")
+        parser.add_argument("--verify", action="store_true",
+                            help="После пересчета сверить результат с расчетом set_next_sent_datetime")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Пакетный пересчет расписания поддерживается только для PostgreSQL")
+
+        now_time = timezone.now()
+        start_time = time.monotonic()
+        updated_count = reschedule(now_time, options["all"], options["chunk_size"])
+        self.stdout.write(f"Обновлено рассылок: {updated_count} за {time.monotonic() - start_time:.2f} с")
+
+        if options["verify"]:
+            mismatches = verify_reschedule(now_time, options["all"])
+            for newsletter_id, date_time_next_sent, expected in mismatches[:20]:
+                self.stdout.write(f"Рассылка {newsletter_id}: в БД {date_time_next_sent}, ожидается {expected}")
+            if mismatches:
+                raise CommandError(f"Расхождений с set_next_sent_datetime: {len(mismatches)}")
+            self.stdout.write("Расхождений с set_next_sent_datetime нет")
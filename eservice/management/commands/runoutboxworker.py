@@ -0,0 +1,29 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from config.settings import OUTBOX_BATCH_SIZE
+from eservice.metrics import flush_metrics
+from eservice.outbox import process_batch
+
+
+class Command(BaseCommand):
+    help = "Runs outbox worker. Any number of workers can be started on any hosts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE,
+                            help="Количество писем, забираемых за один раз")
+        parser.add_argument("--idle-sleep", type=float, default=5,
+                            help="Пауза в секундах, если очередь пуста")
+
+    def handle(self, *args, **options):
+        print("Запуск воркера очереди исходящих писем...")
+        while True:
+            close_old_connections()
+            processed = process_batch(options["batch_size"])
+            flush_metrics()
+            if processed:
+                print(f"Обработано писем: {processed}")
+            else:
+                sleep(options["idle_sleep"])
@@ -0,0 +1,218 @@
+import bisect
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from eservice.models import MetricsSnapshot
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def make_labels(labels: dict) -> str:
+    """Метки в виде строки формата Prometheus: status="sent",mode="pool" """
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+class Counter:
+    """Счетчик, значения хранятся отдельно для каждого набора меток"""
+
+    type = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = make_labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def new_empty(self) -> "Counter":
+        return Counter(self.name, self.help_text)
+
+    def collect(self, reset=False) -> dict:
+        with self._lock:
+            values = dict(self.values)
+            if reset:
+                self.values.clear()
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами. Для каждого набора меток хранятся количества попаданий в корзины
+    (последняя - +Inf), сумма и количество наблюдений
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def new_empty(self) -> "Histogram":
+        return Histogram(self.name, self.help_text, self.buckets)
+
+    def new_value(self) -> dict:
+        return {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+
+    def observe(self, value, **labels):
+        self.observe_many((value,), **labels)
+
+    def observe_many(self, values, **labels):
+        """Несколько наблюдений за одну блокировку: на горячем пути результаты пишутся пачкой"""
+        key = make_labels(labels)
+        with self._lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = self.new_value()
+            counts = histogram["buckets"]
+            for value in values:
+                counts[bisect.bisect_left(self.buckets, value)] += 1
+                histogram["sum"] += value
+                histogram["count"] += 1
+
+    def collect(self, reset=False) -> dict:
+        with self._lock:
+            values = {
+                key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                for key, value in self.values.items()
+            }
+            if reset:
+                self.values.clear()
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                histogram = self.values.setdefault(key, self.new_value())
+                histogram["buckets"] = [a + b for a, b in zip(histogram["buckets"], value["buckets"])]
+                histogram["sum"] += value["sum"]
+                histogram["count"] += value["count"]
+
+
+class MetricsRegistry:
+    """Метрики одного процесса. Значения накапливаются в памяти и периодически сохраняются в БД"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.last_flush_time = 0.0
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text) -> Counter:
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets))
+
+    def collect(self, reset=False) -> dict:
+        return {name: metric.collect(reset) for name, metric in self.metrics.items()}
+
+    def merge(self, data: dict):
+        """Добавляет значения, собранные в другом процессе (например, в процессе пула отправки)"""
+        for name, values in data.items():
+            if name in self.metrics:
+                self.metrics[name].merge(values)
+
+    def render(self, snapshots) -> str:
+        """Сумма значений всех процессов в текстовом формате Prometheus"""
+        lines = []
+        for name, metric in self.metrics.items():
+            total = metric.new_empty()
+            for snapshot in snapshots:
+                total.merge(snapshot.get(name, {}))
+
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for key, value in sorted(total.values.items()):
+                if metric.type == "counter":
+                    lines.append(f"{name}{{{key}}} {value}" if key else f"{name} {value}")
+                    continue
+                separator = "," if key else ""
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value["buckets"]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{key}{separator}le="{bound}"}} {cumulative}')
+                labels = f"{{{key}}}" if key else ""
+                lines.append(f"{name}_sum{labels} {value['sum']}")
+                lines.append(f"{name}_count{labels} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+MESSAGES = registry.counter("esender_messages_total", "Письма по результату отправки (sent, failed)")
+SMTP_CONNECT_SECONDS = registry.histogram(
+    "esender_smtp_connect_seconds", "Время подключения и авторизации на SMTP сервере"
+)
+SMTP_SEND_SECONDS = registry.histogram("esender_smtp_send_seconds", "Время отправки письма (MAIL, RCPT, DATA)")
+TICK_SECONDS = registry.histogram("esender_scheduler_tick_seconds", "Длительность запуска job_every_minute")
+NEWSLETTERS_DUE = registry.counter("esender_newsletters_due_total", "Рассылки, которые пора отправлять")
+NEWSLETTERS_DISPATCHED = registry.counter(
+    "esender_newsletters_dispatched_total", "Рассылки, отправленные или поставленные в очередь исходящих"
+)
+RATE_LIMIT_WAITS = registry.counter(
+    "esender_rate_limit_waits_total", "Письма, отложенные ограничением скорости, по домену из EMAIL_DOMAIN_RATE_LIMITS или other"
+)
+RATE_LIMIT_WAIT_SECONDS = registry.counter(
+    "esender_rate_limit_wait_seconds_total", "Суммарное ожидание ограничения скорости по домену из EMAIL_DOMAIN_RATE_LIMITS или other"
+)
+SCHEDULER_LAG_SECONDS = registry.histogram(
+    "esender_scheduler_lag_seconds", "Опоздание отправки: текущее время минус date_time_next_sent", LAG_BUCKETS
+)
+
+
+def record_results(results):
+    """Учитывает результаты отправки пачки писем"""
+    sent = sum(1 for result in results if result.operation_completed)
+    if sent:
+        MESSAGES.inc(sent, status="sent")
+    if len(results) > sent:
+        MESSAGES.inc(len(results) - sent, status="failed")
+    SMTP_SEND_SECONDS.observe_many([result.latency for result in results if result.smtp_code is not None])
+
+
+def get_process_key() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def flush_metrics(force=False):
+    """
+    Сохраняет метрики процесса в БД (одна запись на процесс), не чаще чем раз в METRICS_FLUSH_INTERVAL секунд.
+    Представление /metrics суммирует записи всех процессов
+    """
+    now = time.monotonic()
+    if not force and now - registry.last_flush_time < settings.METRICS_FLUSH_INTERVAL:
+        return
+    registry.last_flush_time = now
+    MetricsSnapshot.objects.update_or_create(process=get_process_key(), defaults={"data": registry.collect()})
+
+
+def render_metrics() -> str:
+    flush_metrics(force=True)
+    return registry.render(MetricsSnapshot.objects.values_list("data", flat=True))
+
+
+def delete_old_snapshots(max_age):
+    """Удаляет записи процессов, которые давно не обновлялись (процесс завершен)"""
+    MetricsSnapshot.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=max_age)).delete()
@@ -0,0 +1,99 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0012_alter_attemptsnewsletter_options_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date_time_occurrence",
+                    models.DateTimeField(verbose_name="дата и время отправки рассылки"),
+                ),
+                ("email", models.EmailField(max_length=254, verbose_name="Email")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Ожидает отправки"),
+                            ("PROCESSING", "Отправляется"),
+                            ("SENT", "Отправлено"),
+                            ("FAILED", "Ошибка отправки"),
+                        ],
+                        default="PENDING",
+                        max_length=30,
+                        verbose_name="статус письма",
+                    ),
+                ),
+                (
+                    "date_time_claimed",
+                    models.DateTimeField(
+                        blank=True,
+                        null=True,
+                        verbose_name="дата и время захвата воркером",
+                    ),
+                ),
+                (
+                    "date_time_sent",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="дата и время отправки"
+                    ),
+                ),
+                (
+                    "mail_server_response",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="ответ почтового сервера"
+                    ),
+                ),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="outbox_messages",
+                        to="eservice.client",
+                        verbose_name="клиент",
+                    ),
+                ),
+                (
+                    "newsletter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="outbox_messages",
+                        to="eservice.newsletter",
+                        verbose_name="рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Исходящее письмо",
+                "verbose_name_plural": "Исходящие письма",
+                "indexes": [
+                    models.Index(fields=["status", "id"], name="outbox_status_id_idx")
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="outboxmessage",
+            constraint=models.UniqueConstraint(
+                fields=("newsletter", "date_time_occurrence", "client"),
+                name="unique_outbox_message_recipient",
+            ),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0013_outboxmessage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeliveryLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date_time_sent",
+                    models.DateTimeField(verbose_name="дата и время отправки рассылки"),
+                ),
+                ("email", models.EmailField(max_length=254, verbose_name="Email")),
+                (
+                    "status",
+                    models.BooleanField(default=False, verbose_name="статус отправки"),
+                ),
+                (
+                    "smtp_code",
+                    models.PositiveSmallIntegerField(
+                        blank=True, null=True, verbose_name="код ответа SMTP"
+                    ),
+                ),
+                (
+                    "latency_ms",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="время отправки, мс"
+                    ),
+                ),
+                (
+                    "mail_server_response",
+                    models.CharField(
+                        blank=True,
+                        max_length=255,
+                        null=True,
+                        verbose_name="ответ почтового сервера",
+                    ),
+                ),
+                (
+                    "newsletter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="delivery_logs",
+                        to="eservice.newsletter",
+                        verbose_name="рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Запись журнала доставки",
+                "verbose_name_plural": "Журнал доставки",
+                "indexes": [
+                    models.Index(
+                        fields=["newsletter", "date_time_sent"],
+                        name="delivery_log_newsletter_idx",
+                    )
+                ],
+            },
+        ),
+    ]
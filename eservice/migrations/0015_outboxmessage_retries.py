@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0014_deliverylog"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(
+                default=0, verbose_name="количество попыток отправки"
+            ),
+        ),
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="date_time_next_attempt",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="дата и время следующей попытки"
+            ),
+        ),
+    ]
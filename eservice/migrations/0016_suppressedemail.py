@@ -0,0 +1,66 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0015_outboxmessage_retries"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SuppressedEmail",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "email",
+                    models.EmailField(
+                        max_length=254, unique=True, verbose_name="Email"
+                    ),
+                ),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[
+                            ("BOUNCE", "Постоянный отказ сервера"),
+                            ("UNSUBSCRIBE", "Отписка"),
+                            ("MANUAL", "Добавлен вручную"),
+                        ],
+                        default="MANUAL",
+                        max_length=30,
+                        verbose_name="причина",
+                    ),
+                ),
+                (
+                    "is_active",
+                    models.BooleanField(default=True, verbose_name="действует"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="дата добавления"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True, db_index=True, verbose_name="дата изменения"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Адрес в списке исключений",
+                "verbose_name_plural": "Список исключений",
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0016_suppressedemail"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="newsletter",
+            name="delivery_window_minutes",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Распределить отправку писем на указанное количество минут (пусто - отправить сразу)",
+                null=True,
+                verbose_name="окно доставки, минут",
+            ),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0017_newsletter_delivery_window"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SendCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date_time_occurrence",
+                    models.DateTimeField(
+                        verbose_name="дата и время отправки по расписанию"
+                    ),
+                ),
+                (
+                    "client_id_from",
+                    models.PositiveBigIntegerField(
+                        default=0, verbose_name="начало диапазона клиентов"
+                    ),
+                ),
+                (
+                    "last_client_id",
+                    models.PositiveBigIntegerField(
+                        blank=True,
+                        null=True,
+                        verbose_name="последний отправленный клиент",
+                    ),
+                ),
+                (
+                    "is_completed",
+                    models.BooleanField(
+                        default=False, verbose_name="отправка завершена"
+                    ),
+                ),
+                (
+                    "status",
+                    models.BooleanField(default=False, verbose_name="статус попытки"),
+                ),
+                (
+                    "mail_server_response",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="ответ почтового сервера"
+                    ),
+                ),
+                (
+                    "date_time_started",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="дата и время начала отправки"
+                    ),
+                ),
+                (
+                    "date_time_updated",
+                    models.DateTimeField(
+                        auto_now=True, verbose_name="дата и время изменения"
+                    ),
+                ),
+                (
+                    "newsletter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="send_checkpoints",
+                        to="eservice.newsletter",
+                        verbose_name="рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Прогресс отправки рассылки",
+                "verbose_name_plural": "Прогресс отправки рассылок",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="sendcheckpoint",
+            constraint=models.UniqueConstraint(
+                fields=("newsletter", "date_time_occurrence", "client_id_from"),
+                name="send_checkpoint_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0018_sendcheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MetricsSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "process",
+                    models.CharField(
+                        max_length=255, unique=True, verbose_name="процесс"
+                    ),
+                ),
+                (
+                    "data",
+                    models.JSONField(default=dict, verbose_name="значения метрик"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="дата изменения"),
+                ),
+            ],
+            options={
+                "verbose_name": "Метрики процесса",
+                "verbose_name_plural": "Метрики процессов",
+            },
+        ),
+    ]
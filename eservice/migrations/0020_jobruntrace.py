@@ -0,0 +1,53 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0019_metricssnapshot"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobRunTrace",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "job_id",
+                    models.CharField(
+                        db_index=True, max_length=255, verbose_name="задача"
+                    ),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(verbose_name="дата и время запуска"),
+                ),
+                ("duration", models.FloatField(verbose_name="длительность, с")),
+                ("stages", models.JSONField(default=dict, verbose_name="этапы")),
+                (
+                    "profile_path",
+                    models.CharField(
+                        blank=True,
+                        max_length=1024,
+                        null=True,
+                        verbose_name="файл профиля",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Трассировка запуска задачи",
+                "verbose_name_plural": "Трассировки запусков задач",
+                "ordering": ("-started_at",),
+            },
+        ),
+    ]
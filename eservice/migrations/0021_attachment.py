@@ -0,0 +1,61 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:01
+
+import django.db.models.deletion
+import utils.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0020_jobruntrace"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Attachment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "file",
+                    models.FileField(
+                        upload_to=utils.utils.generate_filename_attachment,
+                        verbose_name="файл",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        blank=True, max_length=255, verbose_name="имя файла"
+                    ),
+                ),
+                (
+                    "content_type",
+                    models.CharField(
+                        blank=True, max_length=100, verbose_name="тип содержимого"
+                    ),
+                ),
+                (
+                    "message",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="attachments",
+                        to="eservice.message",
+                        verbose_name="сообщение",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Вложение",
+                "verbose_name_plural": "Вложения",
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0021_attachment"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="newsletter",
+            index=models.Index(
+                condition=models.Q(
+                    ("status__in", ["CREATED", "LAUNCHED"]),
+                    models.Q(("period", "DISABLE"), _negated=True),
+                ),
+                fields=["date_time_next_sent", "date_time_first_sent"],
+                name="newsletter_due_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0022_newsletter_due_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attemptsnewsletter",
+            name="date_time_occurrence",
+            field=models.DateTimeField(
+                blank=True,
+                null=True,
+                verbose_name="дата и время отправки по расписанию",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eservice", "0023_attemptsnewsletter_occurrence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="is_direct_retry",
+            field=models.BooleanField(
+                default=False, verbose_name="повтор прямой отправки"
+            ),
+        ),
+    ]
@@ -0,0 +1,295 @@
+import base64
+import mimetypes
+import mmap
+import re
+import uuid
+from email.mime.base import MIMEBase
+from email.utils import formatdate, make_msgid
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail.message import forbid_multi_line_headers, sanitize_address, RFC5322_EMAIL_LINE_LENGTH_LIMIT
+from django.core.mail.utils import DNS_NAME
+
+from config.settings import EMAIL_HOST_USER
+from eservice.personalization import Personalizer
+
+CRLF = b"\r\n"
+NEWLINE_RE = re.compile(r"\r\n|\r|\n")
+DOT_LINE_RE = re.compile(rb"^\.", re.MULTILINE)
+
+# Base64 кодирует по 57 байт в строку из 76 символов, файл кодируется блоками из целого числа строк
+BASE64_LINE_BYTES = 57
+BASE64_BLOCK_LINES = 1024
+MESSAGE_CONTENT_HEADERS = (b"content-type", b"content-transfer-encoding")
+
+
+def split_message_bytes(subject, body, from_email) -> tuple[bytes, bytes]:
+    """
+    Собирает письмо Django без получателей, Date и Message-ID
+    и возвращает закодированные общие заголовки и тело (вместе с отделяющей пустой строкой)
+    """
+    message = EmailMessage(subject, body, from_email).message()
+    del message["Date"]
+    del message["Message-ID"]
+
+    headers, _, encoded_body = message.as_bytes(linesep="\r\n").partition(CRLF + CRLF)
+    return headers + CRLF, CRLF + encoded_body
+
+
+class PreparedMessage:
+    """
+    Письмо, собранное и закодированное один раз на всю рассылку.
+    Кодирование заголовков и тела (кодировка, base64/quoted-printable кириллицы) выполняется при создании,
+    а для каждого получателя к готовым байтам добавляются только заголовки To, Date и Message-ID
+    """
+
+    streamed = False
+
+    def __init__(self, subject, body, from_email=EMAIL_HOST_USER):
+        self.subject = subject
+        self.body = body
+        self.from_email = from_email
+        self.encoding = settings.DEFAULT_CHARSET
+        self.envelope_from = sanitize_address(from_email, self.encoding) if from_email else ""
+        self.headers, self.encoded_body = split_message_bytes(subject, body, from_email)
+
+    def get_envelope_recipient(self, email) -> str:
+        return sanitize_address(email, self.encoding)
+
+    def get_recipient_headers(self, email) -> bytes:
+        to_header = forbid_multi_line_headers("To", email, self.encoding)[1]
+        return b"".join((
+            b"To: ", to_header.encode("ascii"), CRLF,
+            b"Date: ", formatdate(localtime=settings.EMAIL_USE_LOCALTIME).encode("ascii"), CRLF,
+            b"Message-ID: ", make_msgid(domain=DNS_NAME).encode("ascii"), CRLF,
+        ))
+
+    def get_parts(self, recipient) -> tuple[bytes, bytes, bytes]:
+        """Закодированные общие заголовки, персональные заголовки и тело письма для получателя"""
+        return self.headers, self.get_recipient_headers(recipient.email), self.encoded_body
+
+    def as_bytes(self, recipient) -> bytes:
+        """Готовое письмо для получателя: общие заголовки и тело плюс персональные заголовки"""
+        return b"".join(self.get_parts(recipient))
+
+    def as_email_message(self, recipient) -> EmailMessage:
+        """Обычное письмо Django, для почтовых бэкендов, которые не работают с SMTP напрямую"""
+        return EmailMessage(self.subject, self.body, self.from_email, [recipient.email])
+
+
+class PersonalizedMessage(PreparedMessage):
+    """
+    Письмо с полями подстановки ({{ name }}, {{ unsubscribe_url }} и т.д.).
+    Шаблоны темы и тела разбираются один раз, для каждого получателя они только отрисовываются.
+    Если тема не персональная, а тело передается без перекодирования (7bit/8bit), заголовки тоже собираются
+    один раз для каждого вида кодирования, и для получателя кодируется только текст тела
+    """
+
+    def __init__(self, subject, body, from_email=EMAIL_HOST_USER):
+        self.subject = subject
+        self.body = body
+        self.from_email = from_email
+        self.encoding = settings.DEFAULT_CHARSET
+        self.envelope_from = sanitize_address(from_email, self.encoding) if from_email else ""
+        self.personalizer = Personalizer(subject, body)
+        self.headers_by_transfer_encoding = {}
+
+    def render(self, recipient) -> tuple[str, str]:
+        return self.personalizer.render(recipient)
+
+    def get_unsubscribe_headers(self, context) -> dict:
+        """
+        Заголовки отписки в один клик (RFC 2369, RFC 8058), если в письме есть ссылка для отписки:
+        почтовый клиент отправляет POST на эту же ссылку
+        """
+        if "unsubscribe_url" not in context:
+            return {}
+        return {
+            "List-Unsubscribe": f"<{context['unsubscribe_url']}>",
+            "List-Unsubscribe-Post": "List-Unsubscribe=One-Click",
+        }
+
+    def can_encode_body_directly(self, body) -> bool:
+        # Django кодирует тело в quoted-printable только при строках длиннее лимита RFC 5322,
+        # иначе тело в utf-8 передается как есть
+        return self.encoding == "utf-8" and all(
+            len(line.encode("utf-8")) <= RFC5322_EMAIL_LINE_LENGTH_LIMIT for line in body.splitlines()
+        )
+
+    def get_parts(self, recipient) -> tuple[bytes, bytes, bytes]:
+        # Контекст (с подписанной ссылкой для отписки) считается один раз для текста и заголовков
+        context = self.personalizer.get_context(recipient)
+        subject, body = self.personalizer.render_context(context)
+        recipient_headers = self.get_recipient_headers(recipient.email) + b"".join(
+            b"".join((name.encode("ascii"), b": ", value.encode("ascii"), CRLF))
+            for name, value in self.get_unsubscribe_headers(context).items()
+        )
+
+        if self.personalizer.subject_template.is_static and self.can_encode_body_directly(body):
+            transfer_encoding = "7bit" if body.isascii() else "8bit"
+            if transfer_encoding not in self.headers_by_transfer_encoding:
+                self.headers_by_transfer_encoding[transfer_encoding] = split_message_bytes(
+                    subject, body, self.from_email
+                )[0]
+            headers = self.headers_by_transfer_encoding[transfer_encoding]
+            encoded_body = CRLF + NEWLINE_RE.sub("\r\n", body).encode("utf-8")
+        else:
+            headers, encoded_body = split_message_bytes(subject, body, self.from_email)
+
+        return headers, recipient_headers, encoded_body
+
+    def as_email_message(self, recipient) -> EmailMessage:
+        context = self.personalizer.get_context(recipient)
+        subject, body = self.personalizer.render_context(context)
+        return EmailMessage(subject, body, self.from_email, [recipient.email],
+                            headers=self.get_unsubscribe_headers(context))
+
+
+def encode_file_base64(path) -> memoryview:
+    """
+    Кодирует файл в base64 со строками по 76 символов. Файл отображается в память (mmap), а не читается целиком,
+    результат - один общий буфер только для чтения, который отправляется всем получателям без копирования
+    """
+    encoded = bytearray()
+    with open(path, "rb") as file:
+        if Path(path).stat().st_size == 0:
+            return memoryview(bytes(encoded))
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            block_size = BASE64_LINE_BYTES * BASE64_BLOCK_LINES
+            for block_start in range(0, len(mapped), block_size):
+                block = mapped[block_start:block_start + block_size]
+                for line_start in range(0, len(block), BASE64_LINE_BYTES):
+                    encoded += base64.b64encode(block[line_start:line_start + BASE64_LINE_BYTES])
+                    encoded += CRLF
+    return memoryview(encoded).toreadonly()
+
+
+class AttachmentPart:
+    """Вложение письма: заголовки части MIME и содержимое файла, закодированное в base64 один раз на рассылку"""
+
+    def __init__(self, path, filename, content_type=None):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        part = MIMEBase(*self.content_type.split("/", 1))
+        del part["MIME-Version"]
+        part["Content-Transfer-Encoding"] = "base64"
+        # Имя файла не в ASCII кодируется по RFC 2231
+        part.add_header("Content-Disposition", "attachment", filename=("utf-8", "", filename))
+        self.headers = part.as_bytes(policy=part.policy.clone(linesep="\r\n")).partition(CRLF + CRLF)[0] + CRLF + CRLF
+        self.encoded = encode_file_base64(path)
+
+
+def split_content_headers(headers) -> tuple[bytes, bytes]:
+    """
+    Делит заголовки письма из одной части на заголовки всего письма (Subject, From и т.д.)
+    и заголовки содержимого (Content-Type, Content-Transfer-Encoding), которые переходят в текстовую часть
+    """
+    message_headers, content_headers = [], []
+    for header in re.split(rb"\r\n(?![ \t])", headers.rstrip(CRLF)):
+        name = header.partition(b":")[0].strip().lower()
+        (content_headers if name in MESSAGE_CONTENT_HEADERS else message_headers).append(header + CRLF)
+    return b"".join(message_headers), b"".join(content_headers)
+
+
+class MultipartMessage(PreparedMessage):
+    """
+    Письмо с вложениями (multipart/mixed). Текстовая часть берется из обычного или персонального письма,
+    вложения кодируются один раз и хранятся в общих буферах. Письмо получателю собирается из частей:
+    небольших байтов получателя и общих буферов вложений, которые можно передать в соединение без копирования
+    """
+
+    # Письмо отправляется частями через send_chunks, а не одним куском байтов
+    streamed = True
+
+    def __init__(self, text_message: PreparedMessage, attachments: list[AttachmentPart]):
+        self.text_message = text_message
+        self.attachments = attachments
+        self.subject = text_message.subject
+        self.body = text_message.body
+        self.from_email = text_message.from_email
+        self.encoding = text_message.encoding
+        self.envelope_from = text_message.envelope_from
+        self.boundary = f"==============={uuid.uuid4().hex}=="
+        self.split_headers_cache = {}
+
+    def get_split_headers(self, headers) -> tuple[bytes, bytes]:
+        # Заголовки текстовой части повторяются от получателя к получателю, поэтому делятся один раз
+        if headers not in self.split_headers_cache:
+            self.split_headers_cache[headers] = split_content_headers(headers)
+        return self.split_headers_cache[headers]
+
+    def get_chunks(self, recipient) -> list:
+        """Части письма получателю: байты с заголовками и текстом, и общие буферы вложений"""
+        headers, recipient_headers, encoded_body = self.text_message.get_parts(recipient)
+        message_headers, content_headers = self.get_split_headers(headers)
+        boundary = self.boundary.encode("ascii")
+
+        head = b"".join((
+            message_headers,
+            b'Content-Type: multipart/mixed; boundary="', boundary, b'"', CRLF,
+            recipient_headers, CRLF,
+            b"--", boundary, CRLF, content_headers, encoded_body, CRLF,
+        ))
+        chunks = [head]
+        for attachment in self.attachments:
+            chunks.append(b"".join((b"--", boundary, CRLF, attachment.headers)))
+            chunks.append(attachment.encoded)
+        chunks.append(b"".join((b"--", boundary, b"--", CRLF)))
+        return chunks
+
+    def get_smtp_chunks(self, recipient) -> list:
+        """
+        Части письма для команды DATA: строки, начинающиеся с точки, удваиваются (RFC 5321).
+        В base64 точек нет, поэтому буферы вложений передаются как есть
+        """
+        chunks = self.get_chunks(recipient)
+        return [chunk if isinstance(chunk, memoryview) else DOT_LINE_RE.sub(b"..", chunk) for chunk in chunks]
+
+    def as_bytes(self, recipient) -> bytes:
+        return b"".join(self.get_chunks(recipient))
+
+    def as_email_message(self, recipient) -> EmailMessage:
+        email_message = self.text_message.as_email_message(recipient)
+        for attachment in self.attachments:
+            email_message.attach(attachment.filename, Path(attachment.path).read_bytes(), attachment.content_type)
+        return email_message
+
+
+@lru_cache(maxsize=8)
+def prepare_multipart_message(subject, body, attachments, from_email=EMAIL_HOST_USER) -> MultipartMessage:
+    """
+    Кэш писем с вложениями, ключом служат и файлы вложений. Загруженный файл всегда сохраняется под новым именем,
+    поэтому замена вложения дает новый ключ. Кэш небольшой: каждое письмо держит в памяти закодированные файлы
+    """
+    return MultipartMessage(
+        prepare_message(subject, body, from_email),
+        [AttachmentPart(path, filename, content_type) for path, filename, content_type in attachments],
+    )
+
+
+@lru_cache(maxsize=128)
+def prepare_message(subject, body, from_email=EMAIL_HOST_USER) -> PreparedMessage:
+    """
+    Кэш готовых писем: ключом служат тема, тело и отправитель, поэтому измененное сообщение
+    собирается заново, а одно и то же сообщение собирается один раз на все рассылки и запуски.
+    Сообщения с полями подстановки собираются для каждого получателя по разобранным один раз шаблонам
+    """
+    if Personalizer(subject, body).is_static:
+        return PreparedMessage(subject, body, from_email)
+    return PersonalizedMessage(subject, body, from_email)
+
+
+def get_prepared_message(message) -> PreparedMessage:
+    """Готовое письмо для модели Message, вложения могут быть загружены заранее через prefetch_related"""
+    attachments = tuple(
+        (attachment.file.path, attachment.name, attachment.content_type or None)
+        for attachment in sorted(message.attachments.all(), key=lambda attachment: attachment.id)
+    )
+    if attachments:
+        return prepare_multipart_message(message.subject or "", message.body or "", attachments)
+    return prepare_message(message.subject or "", message.body or "")
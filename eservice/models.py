@@ -1,13 +1,19 @@
 import datetime
+import mimetypes
+import pathlib
 
 from dateutil.relativedelta import relativedelta
 from django.db import models
 from django.db.models import Q, QuerySet
 from django.utils import timezone
 
+from config.settings import DELIVERY_LOG_BATCH_SIZE, OUTBOX_BATCH_SIZE, EMAIL_RETRY_MAX_ATTEMPTS, \
+    NEWSLETTER_DELIVERY_WINDOW_MINUTES, NEWSLETTER_DELIVERY_WINDOW_THRESHOLD
+
 from eservice.models_services import get_cached_newsletters_count, get_cached_unique_clients_count, \
-    get_cached_total_active_newsletters
+    get_cached_total_active_newsletters, get_retry_datetime
 from users.models import User
+from utils.utils import generate_filename_attachment
 
 NULLABLE = {"blank": True, "null": True}
 
@@ -69,6 +75,38 @@ class Message(models.Model):
         verbose_name_plural = "Сообщения"
 
 
+class Attachment(models.Model):
+    """
+    Вложение сообщения (счет, прайс-лист). Файл кодируется один раз на рассылку и отправляется всем получателям
+    из общего буфера, поэтому размер файла не умножается на количество получателей
+    """
+
+    message = models.ForeignKey(
+        Message,
+        verbose_name="сообщение",
+        on_delete=models.CASCADE,
+        related_name="attachments",
+    )
+    file = models.FileField(upload_to=generate_filename_attachment, verbose_name="файл")
+    # Файл сохраняется под случайным именем, получатели видят исходное имя
+    name = models.CharField(max_length=255, verbose_name="имя файла", blank=True)
+    content_type = models.CharField(max_length=100, verbose_name="тип содержимого", blank=True)
+
+    def save(self, *args, **kwargs):
+        if not self.name:
+            self.name = pathlib.Path(self.file.name).name
+        if not self.content_type:
+            self.content_type = mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name}"
+
+    class Meta:
+        verbose_name = "Вложение"
+        verbose_name_plural = "Вложения"
+
+
 class Newsletter(models.Model):
     PERIOD_DISABLE = "DISABLE"
     PERIOD_EVERY_DAY = "EVERY_DAY"
@@ -126,6 +164,13 @@ class Newsletter(models.Model):
         verbose_name="дата и время следующей рассылки", blank=True, null=True
     )
 
+    # Письма рассылки отправляются равными частями каждую минуту в течение окна, а не все сразу
+    delivery_window_minutes = models.PositiveIntegerField(
+        verbose_name="окно доставки, минут",
+        help_text="Распределить отправку писем на указанное количество минут (пусто - отправить сразу)",
+        **NULLABLE
+    )
+
     owner = models.ForeignKey(
         User,
         verbose_name="Владелец",
@@ -146,16 +191,46 @@ class Newsletter(models.Model):
         )  # Сбрасываем секунды для корректного сравнения
         print(now_time)
 
-        query = Q(status=cls.STATUS_CREATED)
-        query.add(Q(status=cls.STATUS_LAUNCHED), Q.OR)
-        query.add(Q(date_time_next_sent__lte=now_time), Q.AND)
-        query.add(Q(date_time_first_sent__lte=now_time), Q.AND)
-        query.add(~Q(period=cls.PERIOD_DISABLE), Q.AND)
-
-        newsletters = cls.objects.filter(query)
+        # Условие по статусу и периодичности совпадает с условием частичного индекса newsletter_due_idx,
+        # поэтому выбираются только строки индекса по date_time_next_sent, без просмотра всей таблицы
+        newsletters = cls.objects.filter(
+            cls.get_active_schedule_query(),
+            date_time_next_sent__lte=now_time,
+            date_time_first_sent__lte=now_time,
+        ).order_by("date_time_next_sent")
         return newsletters
 
+    @classmethod
+    def get_active_schedule_query(cls) -> Q:
+        """Рассылки, которые еще будут отправляться (условие частичного индекса newsletter_due_idx)"""
+        return Q(status__in=[cls.STATUS_CREATED, cls.STATUS_LAUNCHED]) & ~Q(period=cls.PERIOD_DISABLE)
+
+    def get_recipients_count(self) -> int:
+        """Количество клиентов рассылки: из аннотации recipients_count, если рассылка загружена с ней"""
+        if hasattr(self, "recipients_count"):
+            return self.recipients_count
+        return self.clients.count()
+
+    def get_delivery_window_minutes(self) -> int:
+        """
+        Окно доставки рассылки в минутах: собственное, а если не задано - общее окно
+        для рассылок от NEWSLETTER_DELIVERY_WINDOW_THRESHOLD получателей. 0 - отправка сразу
+        """
+        if self.delivery_window_minutes:
+            return self.delivery_window_minutes
+        if NEWSLETTER_DELIVERY_WINDOW_MINUTES and self.get_recipients_count() >= NEWSLETTER_DELIVERY_WINDOW_THRESHOLD:
+            return NEWSLETTER_DELIVERY_WINDOW_MINUTES
+        return 0
+
     def set_next_sent_datetime(self):
+        self.compute_next_sent_datetime()
+        self.save()
+
+    def compute_next_sent_datetime(self, now_time=None):
+        """
+        Вычисляет следующее время отправки без сохранения в БД (для пакетного обновления рассылок).
+        now_time - момент, от которого считается расписание, по умолчанию текущее время
+        """
 
         def get_next_day_date(date_time_start_sent, now_time):
             # К дате/времени начала рассылки прибавляются недостающие дни к текущей дате
@@ -190,7 +265,7 @@ class Newsletter(models.Model):
         date_time_start_sent = self.date_time_first_sent.replace(
             second=0, microsecond=0
         )
-        now_time = timezone.now().replace(second=0, microsecond=0)
+        now_time = (now_time or timezone.now()).replace(second=0, microsecond=0)
 
         match self.period:
             case self.PERIOD_EVERY_DAY:
@@ -218,15 +293,19 @@ class Newsletter(models.Model):
             case _:
                 pass
 
-        self.save()
-
     def refresh_status(self):
+        if self.compute_status():
+            self.save()
+
+    def compute_status(self) -> bool:
+        """Вычисляет статус без сохранения в БД, возвращает True, если статус изменился"""
         new_status = self.make_status(
             self.date_time_first_sent, self.date_time_last_sent
         )
         if self.status != new_status:
             self.status = new_status
-            self.save()
+            return True
+        return False
 
     @classmethod
     def make_status(cls, date_time_first_sent, date_time_last_sent):
@@ -256,6 +335,13 @@ class Newsletter(models.Model):
     class Meta(MetaManagerPermissionsMixin):
         verbose_name = "Рассылка"
         verbose_name_plural = "Рассылки"
+        indexes = [
+            models.Index(
+                fields=["date_time_next_sent", "date_time_first_sent"],
+                name="newsletter_due_idx",
+                condition=Q(status__in=["CREATED", "LAUNCHED"]) & ~Q(period="DISABLE"),
+            ),
+        ]
 
 
 class AttemptsNewsletter(models.Model):
@@ -272,6 +358,10 @@ class AttemptsNewsletter(models.Model):
     date_time_last_sent = models.DateTimeField(
         verbose_name="дата и время последней попытки"
     )
+    # Время отправки по расписанию (date_time_next_sent на момент отправки), одна попытка на каждую отправку
+    date_time_occurrence = models.DateTimeField(
+        verbose_name="дата и время отправки по расписанию", **NULLABLE
+    )
     status = models.BooleanField(default=False, verbose_name="статус попытки")
     mail_server_response = models.TextField(
         verbose_name="ответ почтового сервера", **NULLABLE
@@ -292,3 +382,391 @@ class AttemptsNewsletter(models.Model):
     class Meta(MetaManagerPermissionsMixin):
         verbose_name = "Попытка рассылки"
         verbose_name_plural = "Попытки рассылки"
+
+
+class OutboxMessage(models.Model):
+    """
+    Модель исходящего письма: одна запись на получателя в рамках одной отправки рассылки.
+    Записи забираются воркерами (python manage.py runoutboxworker) через SELECT ... FOR UPDATE SKIP LOCKED
+    """
+
+    STATUS_PENDING = "PENDING"
+    STATUS_PROCESSING = "PROCESSING"
+    STATUS_SENT = "SENT"
+    STATUS_FAILED = "FAILED"
+
+    STATUS_CHOICES = {
+        STATUS_PENDING: "Ожидает отправки",
+        STATUS_PROCESSING: "Отправляется",
+        STATUS_SENT: "Отправлено",
+        STATUS_FAILED: "Ошибка отправки",
+    }
+
+    newsletter = models.ForeignKey(
+        Newsletter,
+        verbose_name="рассылка",
+        on_delete=models.CASCADE,
+        related_name="outbox_messages",
+    )
+    client = models.ForeignKey(
+        Client,
+        verbose_name="клиент",
+        on_delete=models.CASCADE,
+        related_name="outbox_messages",
+    )
+    date_time_occurrence = models.DateTimeField(
+        verbose_name="дата и время отправки рассылки"
+    )
+    email = models.EmailField(verbose_name="Email")
+    status = models.CharField(
+        max_length=30,
+        verbose_name="статус письма",
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+    date_time_claimed = models.DateTimeField(
+        verbose_name="дата и время захвата воркером", **NULLABLE
+    )
+    date_time_sent = models.DateTimeField(
+        verbose_name="дата и время отправки", **NULLABLE
+    )
+    mail_server_response = models.TextField(
+        verbose_name="ответ почтового сервера", **NULLABLE
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="количество попыток отправки")
+    # Пусто - письмо можно отправлять сразу, иначе не раньше указанного времени (повтор после временной ошибки)
+    date_time_next_attempt = models.DateTimeField(
+        verbose_name="дата и время следующей попытки", **NULLABLE
+    )
+    # Повтор письма рассылки, отправленной напрямую (не через очередь): попытку такой рассылки сохраняет
+    # запуск планировщика, поэтому воркеры очереди по таким письмам попытку не создают
+    is_direct_retry = models.BooleanField(default=False, verbose_name="повтор прямой отправки")
+
+    def apply_result(self, result):
+        """
+        Отмечает результат попытки отправки. Временная ошибка возвращает письмо в очередь
+        с экспоненциальной задержкой, пока не исчерпаны попытки
+        """
+        self.attempts += 1
+        if result is not None and result.operation_completed:
+            self.status = self.STATUS_SENT
+            self.date_time_sent = timezone.now()
+            self.mail_server_response = "OK"
+            return
+
+        self.mail_server_response = result.operation_text if result else ""
+        if result is not None and result.transient and self.attempts < EMAIL_RETRY_MAX_ATTEMPTS:
+            self.status = self.STATUS_PENDING
+            self.date_time_next_attempt = get_retry_datetime(self.attempts)
+        else:
+            self.status = self.STATUS_FAILED
+
+    @classmethod
+    def schedule_retries(cls, newsletter, occurrence, results):
+        """Ставит в очередь повторную отправку писем, не отправленных из-за временной ошибки"""
+        retries = []
+        for result in results:
+            if result.operation_completed or not result.transient or result.client_id is None:
+                continue
+            retry = cls(newsletter=newsletter, client_id=result.client_id, email=result.email,
+                        date_time_occurrence=occurrence, status=cls.STATUS_PROCESSING, is_direct_retry=True)
+            retry.apply_result(result)
+            if retry.status == cls.STATUS_PENDING:
+                retries.append(retry)
+        cls.objects.bulk_create(retries, batch_size=OUTBOX_BATCH_SIZE, ignore_conflicts=True)
+        return len(retries)
+
+    @classmethod
+    def make_operation_result(cls, newsletter, occurrence):
+        """
+        Общий результат отправки рассылки по ее письмам в очереди, по тем же правилам что и для AttemptsNewsletter:
+        если хотя бы одно письмо отправлено - успех, иначе ответ сервера для первого письма.
+        None, если письма отправки еще не обработаны (ожидают отправки или повтора)
+        """
+        outbox_messages = cls.objects.filter(newsletter=newsletter, date_time_occurrence=occurrence)
+        if outbox_messages.filter(status__in=[cls.STATUS_PENDING, cls.STATUS_PROCESSING]).exists():
+            return None
+        if outbox_messages.filter(status=cls.STATUS_SENT).exists():
+            return True, "OK"
+
+        first_error = outbox_messages.order_by("id").values_list("mail_server_response", flat=True).first()
+        if first_error is None:
+            return False, "Нет получателей"
+        return False, first_error
+
+    def __str__(self):
+        return f"{self.email}; {self.date_time_occurrence}; {self.status}"
+
+    class Meta:
+        verbose_name = "Исходящее письмо"
+        verbose_name_plural = "Исходящие письма"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["newsletter", "date_time_occurrence", "client"],
+                name="unique_outbox_message_recipient",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "id"], name="outbox_status_id_idx"),
+        ]
+
+
+class DeliveryLog(models.Model):
+    """
+    Компактный журнал доставки: одна запись на получателя в каждой отправке рассылки.
+    Содержит статус, код ответа SMTP сервера и время отправки письма.
+    Записывается пачками через bulk_create, общий результат попытки рассылки хранится в AttemptsNewsletter
+    """
+
+    newsletter = models.ForeignKey(
+        Newsletter,
+        verbose_name="рассылка",
+        on_delete=models.CASCADE,
+        related_name="delivery_logs",
+    )
+    date_time_sent = models.DateTimeField(verbose_name="дата и время отправки рассылки")
+    email = models.EmailField(verbose_name="Email")
+    status = models.BooleanField(default=False, verbose_name="статус отправки")
+    smtp_code = models.PositiveSmallIntegerField(verbose_name="код ответа SMTP", **NULLABLE)
+    latency_ms = models.PositiveIntegerField(default=0, verbose_name="время отправки, мс")
+    mail_server_response = models.CharField(
+        max_length=255, verbose_name="ответ почтового сервера", **NULLABLE
+    )
+
+    @classmethod
+    def save_results(cls, newsletter, date_time_sent, results):
+        """Сохраняет результаты отправки по получателям пачками по DELIVERY_LOG_BATCH_SIZE записей"""
+        batch = []
+        for result in results:
+            batch.append(
+                cls(
+                    newsletter=newsletter,
+                    date_time_sent=date_time_sent,
+                    email=result.email,
+                    status=result.operation_completed,
+                    smtp_code=result.smtp_code,
+                    latency_ms=int(result.latency * 1000),
+                    mail_server_response=result.operation_text[:255] or None,
+                )
+            )
+            if len(batch) >= DELIVERY_LOG_BATCH_SIZE:
+                cls.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            cls.objects.bulk_create(batch)
+
+    def __str__(self):
+        return f"{self.email}; {self.date_time_sent}; {self.status}; {self.smtp_code}"
+
+    class Meta:
+        verbose_name = "Запись журнала доставки"
+        verbose_name_plural = "Журнал доставки"
+        indexes = [
+            models.Index(fields=["newsletter", "date_time_sent"], name="delivery_log_newsletter_idx"),
+        ]
+
+
+class SuppressedEmail(models.Model):
+    """
+    Модель списка исключений: адреса, на которые рассылки не отправляются
+    (постоянный отказ почтового сервера получателя, отписка или ручное добавление)
+    """
+
+    REASON_BOUNCE = "BOUNCE"
+    REASON_UNSUBSCRIBE = "UNSUBSCRIBE"
+    REASON_MANUAL = "MANUAL"
+
+    REASON_CHOICES = {
+        REASON_BOUNCE: "Постоянный отказ сервера",
+        REASON_UNSUBSCRIBE: "Отписка",
+        REASON_MANUAL: "Добавлен вручную",
+    }
+
+    # Коды постоянного отказа в получателе: ящик не существует, пользователь не найден, недопустимый адрес
+    BOUNCE_SMTP_CODES = (550, 551, 553)
+
+    email = models.EmailField(unique=True, verbose_name="Email")
+    reason = models.CharField(
+        max_length=30, verbose_name="причина", choices=REASON_CHOICES, default=REASON_MANUAL
+    )
+    is_active = models.BooleanField(default=True, verbose_name="действует")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="дата добавления")
+    # По этому полю списки исключений в памяти воркеров догружают изменения
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="дата изменения")
+
+    @classmethod
+    def suppress(cls, emails, reason):
+        """Добавляет адреса в список исключений (или снова включает ранее отключенные) одним запросом"""
+        suppressed = [cls(email=email.lower(), reason=reason, is_active=True) for email in set(emails)]
+        cls.objects.bulk_create(
+            suppressed,
+            update_conflicts=True,
+            unique_fields=["email"],
+            update_fields=["reason", "is_active", "updated_at"],
+        )
+        return len(suppressed)
+
+    @classmethod
+    def suppress_bounces(cls, results):
+        """Добавляет в список исключений адреса, получившие постоянный отказ сервера получателя"""
+        emails = [
+            result.email
+            for result in results
+            if not result.operation_completed and result.bounced and result.smtp_code in cls.BOUNCE_SMTP_CODES
+        ]
+        if emails:
+            cls.suppress(emails, cls.REASON_BOUNCE)
+        return len(emails)
+
+    def save(self, *args, **kwargs):
+        self.email = self.email.lower()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.email}; {self.get_reason_display()}; {self.is_active}"
+
+    class Meta:
+        verbose_name = "Адрес в списке исключений"
+        verbose_name_plural = "Список исключений"
+
+
+class SendCheckpoint(models.Model):
+    """
+    Прогресс отправки рассылки для одной отправки (date_time_occurrence - date_time_next_sent на момент отправки).
+    После каждой отправленной пачки получателей сохраняется наибольший идентификатор клиента пачки,
+    поэтому после падения процесса отправка продолжается со следующего клиента, без повторов и без пропусков.
+    Часть рассылки, отправляемая отдельным процессом, имеет свою отметку (client_id_from - начало диапазона)
+    """
+
+    newsletter = models.ForeignKey(
+        Newsletter,
+        verbose_name="рассылка",
+        on_delete=models.CASCADE,
+        related_name="send_checkpoints",
+    )
+    date_time_occurrence = models.DateTimeField(verbose_name="дата и время отправки по расписанию")
+    client_id_from = models.PositiveBigIntegerField(default=0, verbose_name="начало диапазона клиентов")
+    last_client_id = models.PositiveBigIntegerField(verbose_name="последний отправленный клиент", **NULLABLE)
+    is_completed = models.BooleanField(default=False, verbose_name="отправка завершена")
+    status = models.BooleanField(default=False, verbose_name="статус попытки")
+    mail_server_response = models.TextField(verbose_name="ответ почтового сервера", **NULLABLE)
+    date_time_started = models.DateTimeField(auto_now_add=True, verbose_name="дата и время начала отправки")
+    date_time_updated = models.DateTimeField(auto_now=True, verbose_name="дата и время изменения")
+
+    @classmethod
+    def get_for(cls, newsletter, client_id_from=None) -> "SendCheckpoint":
+        """
+        Отметка прогресса отправки. Если отправка еще не начиналась, возвращается новая отметка без записи в БД,
+        она сохраняется вместе с результатами первой пачки
+        """
+        checkpoint = cls.objects.filter(
+            newsletter=newsletter,
+            date_time_occurrence=newsletter.date_time_next_sent,
+            client_id_from=client_id_from or 0,
+        ).first()
+        if checkpoint is None:
+            checkpoint = cls(
+                newsletter=newsletter,
+                date_time_occurrence=newsletter.date_time_next_sent,
+                client_id_from=client_id_from or 0,
+            )
+        return checkpoint
+
+    @classmethod
+    def get_for_newsletters(cls, newsletters) -> dict:
+        """Отметки прогресса отправки рассылок целиком (без деления на части) одним запросом, ключ - id рассылки"""
+        checkpoints = {
+            (checkpoint.newsletter_id, checkpoint.date_time_occurrence): checkpoint
+            for checkpoint in cls.objects.filter(
+                newsletter__in=newsletters,
+                date_time_occurrence__in={newsletter.date_time_next_sent for newsletter in newsletters},
+                client_id_from=0,
+            )
+        }
+        return {
+            newsletter.id: checkpoints.get((newsletter.id, newsletter.date_time_next_sent)) or cls(
+                newsletter=newsletter, date_time_occurrence=newsletter.date_time_next_sent, client_id_from=0
+            )
+            for newsletter in newsletters
+        }
+
+    def add_chunk_result(self, last_client_id, operation_result, is_last=False):
+        """
+        Отмечает пачку отправленной, а последнюю пачку - и всю отправку завершенной, одной записью.
+        Вызывается в одной транзакции с сохранением результатов пачки
+        """
+        self.last_client_id = last_client_id
+        self.is_completed = is_last
+        if operation_result[0]:
+            self.status, self.mail_server_response = True, "OK"
+        elif not self.status and self.mail_server_response is None:
+            # Как и в make_operation_result, при отсутствии успешных писем сохраняется первая ошибка
+            self.mail_server_response = operation_result[1]
+        self.save_progress(["last_client_id", "is_completed", "status", "mail_server_response"])
+
+    def complete(self):
+        self.is_completed = True
+        if self.mail_server_response is None:
+            self.mail_server_response = "Нет получателей"
+        self.save_progress(["is_completed", "mail_server_response"])
+
+    def save_progress(self, fields):
+        # Новая отметка вставляется целиком, существующая обновляется только по измененным полям
+        if self.pk is None:
+            self.save()
+        else:
+            self.save(update_fields=[*fields, "date_time_updated"])
+
+    def get_operation_result(self) -> tuple:
+        return self.date_time_started, self.status, self.mail_server_response
+
+    def __str__(self):
+        return f"{self.newsletter_id}; {self.date_time_occurrence}; {self.last_client_id}; {self.is_completed}"
+
+    class Meta:
+        verbose_name = "Прогресс отправки рассылки"
+        verbose_name_plural = "Прогресс отправки рассылок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["newsletter", "date_time_occurrence", "client_id_from"], name="send_checkpoint_unique"
+            ),
+        ]
+
+
+class MetricsSnapshot(models.Model):
+    """
+    Метрики одного процесса (планировщик, воркер очереди, веб приложение), сохраненные в БД.
+    Каждый процесс периодически перезаписывает свою запись, представление /metrics суммирует все записи
+    """
+
+    process = models.CharField(max_length=255, unique=True, verbose_name="процесс")
+    data = models.JSONField(default=dict, verbose_name="значения метрик")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="дата изменения")
+
+    def __str__(self):
+        return f"{self.process}; {self.updated_at}"
+
+    class Meta:
+        verbose_name = "Метрики процесса"
+        verbose_name_plural = "Метрики процессов"
+
+
+class JobRunTrace(models.Model):
+    """
+    Разбивка времени одного запуска задачи планировщика по этапам (запрос рассылок, чтение получателей,
+    отправка, сохранение результатов и т.д.). Хранится рядом с DjangoJobExecution того же job_id
+    """
+
+    job_id = models.CharField(max_length=255, db_index=True, verbose_name="задача")
+    started_at = models.DateTimeField(verbose_name="дата и время запуска")
+    duration = models.FloatField(verbose_name="длительность, с")
+    stages = models.JSONField(default=dict, verbose_name="этапы")
+    profile_path = models.CharField(max_length=1024, verbose_name="файл профиля", **NULLABLE)
+
+    def __str__(self):
+        return f"{self.job_id}; {self.started_at}; {self.duration:.3f}"
+
+    class Meta:
+        verbose_name = "Трассировка запуска задачи"
+        verbose_name_plural = "Трассировки запусков задач"
+        ordering = ("-started_at",)
@@ -1,4 +1,8 @@
+import random
+from datetime import timedelta
+
 from django.core.cache import cache
+from django.utils import timezone
 
 from config import settings
 
@@ -40,3 +44,14 @@ def get_cached_unique_clients_count(cls):
         cache.set(key, unique_clients_count)
 
     return unique_clients_count
+
+
+def get_retry_datetime(attempts):
+    """
+    Время следующей попытки отправки после attempts неудачных: задержка растет экспоненциально
+    от EMAIL_RETRY_BASE_DELAY до EMAIL_RETRY_MAX_DELAY, половина задержки случайная,
+    чтобы повторы разных писем не собирались в один момент
+    """
+    delay = min(settings.EMAIL_RETRY_MAX_DELAY, settings.EMAIL_RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    return timezone.now() + timedelta(seconds=delay)
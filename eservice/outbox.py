@@ -0,0 +1,172 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q, F
+from django.utils import timezone
+
+from config.settings import OUTBOX_BATCH_SIZE, OUTBOX_CLAIM_TIMEOUT
+from eservice.email import get_sender, Recipient
+from eservice.metrics import record_results
+from eservice.mime import get_prepared_message
+from eservice.models import Newsletter, OutboxMessage, AttemptsNewsletter, DeliveryLog, SuppressedEmail
+from eservice.planner import plan_dispatch
+from eservice.suppression import get_suppression_list
+
+
+def enqueue(newsletter: Newsletter, window_minutes=0) -> int:
+    """
+    Ставит письма рассылки в очередь исходящих: одна запись на каждого клиента.
+    Отправка определяется текущим date_time_next_sent, поэтому повторная постановка
+    той же отправки (например, после падения до сдвига времени рассылки) не создает дублей.
+    С окном доставки window_minutes письма делятся на равные части, каждая становится доступной
+    воркерам на минуту позже предыдущей. Клиенты читаются потоком и сохраняются пачками по OUTBOX_BATCH_SIZE,
+    размер частей считается по количеству получателей из аннотации recipients_count
+    """
+    occurrence = newsletter.date_time_next_sent
+    clients = newsletter.clients.order_by("id").values_list("id", "email").iterator(chunk_size=OUTBOX_BATCH_SIZE)
+    suppression_list = get_suppression_list()
+    count = newsletter.get_recipients_count() if window_minutes > 1 else 0
+    start_time = timezone.now()
+
+    enqueued_count = 0
+    outbox_messages = []
+    for index, (client_id, email) in enumerate(clients):
+        if email in suppression_list:
+            continue
+        outbox_message = OutboxMessage(
+            newsletter=newsletter, client_id=client_id, email=email, date_time_occurrence=occurrence
+        )
+        if count:
+            # Клиенты могли добавиться после подсчета, они попадают в последнюю часть
+            minutes = min(index * window_minutes // count, window_minutes - 1)
+            if minutes:
+                outbox_message.date_time_next_attempt = start_time + timedelta(minutes=minutes)
+        outbox_messages.append(outbox_message)
+        if len(outbox_messages) >= OUTBOX_BATCH_SIZE:
+            OutboxMessage.objects.bulk_create(outbox_messages, ignore_conflicts=True)
+            enqueued_count += len(outbox_messages)
+            outbox_messages = []
+    if outbox_messages:
+        OutboxMessage.objects.bulk_create(outbox_messages, ignore_conflicts=True)
+        enqueued_count += len(outbox_messages)
+    return enqueued_count
+
+
+def claim_batch(batch_size=OUTBOX_BATCH_SIZE) -> list[OutboxMessage]:
+    """
+    Захватывает пачку писем для отправки. Заблокированные другими воркерами строки пропускаются (SKIP LOCKED),
+    поэтому любое количество воркеров может работать одновременно, не получая одни и те же письма.
+    Письма, захваченные давно и так и не отправленные (воркер упал), захватываются повторно
+    """
+    now_time = timezone.now()
+    stale_time = now_time - timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)
+
+    query = Q(status=OutboxMessage.STATUS_PENDING)
+    query.add(Q(status=OutboxMessage.STATUS_PROCESSING, date_time_claimed__lt=stale_time), Q.OR)
+    # Повторы после временных ошибок доступны только после истечения задержки
+    query.add(Q(date_time_next_attempt__isnull=True) | Q(date_time_next_attempt__lte=now_time), Q.AND)
+
+    with transaction.atomic():
+        ids = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(query)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        OutboxMessage.objects.filter(id__in=ids).update(
+            status=OutboxMessage.STATUS_PROCESSING, date_time_claimed=now_time
+        )
+
+    return list(
+        OutboxMessage.objects.filter(id__in=ids)
+        .select_related("newsletter__message")
+        .annotate(client_name=F("client__name"))
+    )
+
+
+def process_batch(batch_size=OUTBOX_BATCH_SIZE) -> int:
+    """
+    Захватывает, отправляет и отмечает пачку писем. Возвращает количество обработанных писем
+    """
+    outbox_messages = claim_batch(batch_size)
+
+    newsletters = {}
+    for outbox_message in outbox_messages:
+        newsletters.setdefault(outbox_message.newsletter_id, []).append(outbox_message)
+
+    for newsletter_messages in newsletters.values():
+        send_newsletter_messages(newsletter_messages)
+
+    return len(outbox_messages)
+
+
+def send_newsletter_messages(outbox_messages: list[OutboxMessage]):
+    """
+    Отправляет письма одной рассылки и сохраняет результат каждого письма.
+    Общий результат попытки рассылки сохраняется в AttemptsNewsletter один раз на отправку,
+    когда обработано последнее письмо этой отправки.
+    Письма группируются по домену (или почтовому серверу) получателя, группа уходит через одно соединение
+    """
+    newsletter = outbox_messages[0].newsletter
+    send_time = timezone.now()
+
+    # Адреса, попавшие в список исключений уже после постановки в очередь, не отправляются
+    suppression_list = get_suppression_list()
+    recipients = [
+        Recipient(outbox_message.client_id, outbox_message.email, outbox_message.client_name)
+        for outbox_message in outbox_messages
+        if outbox_message.email not in suppression_list
+    ]
+
+    groups = plan_dispatch(recipients)
+    prepared = get_prepared_message(newsletter.message)
+    results = get_sender(prepared).send_groups(prepared, groups)
+    record_results(results)
+
+    results_by_client = {result.client_id: result for result in results}
+    for outbox_message in outbox_messages:
+        if outbox_message.email in suppression_list:
+            outbox_message.status = OutboxMessage.STATUS_FAILED
+            outbox_message.mail_server_response = "Адрес в списке исключений"
+        else:
+            outbox_message.apply_result(results_by_client.get(outbox_message.client_id))
+
+    with transaction.atomic():
+        OutboxMessage.objects.bulk_update(
+            outbox_messages,
+            ["status", "date_time_sent", "mail_server_response", "attempts", "date_time_next_attempt"],
+            batch_size=OUTBOX_BATCH_SIZE,
+        )
+        DeliveryLog.save_results(newsletter, send_time, results)
+        SuppressedEmail.suppress_bounces(results)
+        # Попытку рассылки, отправленной напрямую, сохраняет запуск планировщика (finish_newsletters_sending)
+        save_finished_attempts(newsletter, {
+            outbox_message.date_time_occurrence for outbox_message in outbox_messages
+            if not outbox_message.is_direct_retry
+        })
+
+
+def save_finished_attempts(newsletter: Newsletter, occurrences):
+    """
+    Сохраняет попытку рассылки для каждой отправки, у которой не осталось писем в очереди.
+    Рассылка блокируется до конца транзакции, поэтому из воркеров, одновременно отправивших
+    последние письма одной отправки, попытку сохранит только последний
+    """
+    if not occurrences:
+        return
+    list(Newsletter.objects.select_for_update().filter(id=newsletter.id).values_list("id", flat=True))
+    for occurrence in occurrences:
+        operation_result = OutboxMessage.make_operation_result(newsletter, occurrence)
+        if operation_result is None:
+            continue
+        if AttemptsNewsletter.objects.filter(newsletter=newsletter, date_time_occurrence=occurrence).exists():
+            # Повторно захваченное письмо (воркер упал) отправлено после сохранения попытки
+            continue
+        AttemptsNewsletter.objects.create(
+            newsletter=newsletter,
+            date_time_last_sent=timezone.now(),
+            date_time_occurrence=occurrence,
+            status=operation_result[0],
+            mail_server_response=operation_result[1],
+            owner_id=newsletter.owner_id
+        )
@@ -0,0 +1,83 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+
+# Поля подстановки в теме и теле сообщения: {{ name }} - Ф. И. О. клиента, {{ email }} - его адрес,
+# {{ unsubscribe_url }} - ссылка для отписки от рассылок
+MERGE_FIELDS = ("name", "email", "unsubscribe_url")
+MERGE_FIELD_RE = re.compile(r"{{\s*(" + "|".join(MERGE_FIELDS) + r")\s*}}")
+
+UNSUBSCRIBE_SALT = "eservice.unsubscribe"
+
+
+class CompiledTemplate:
+    """
+    Шаблон, разобранный один раз: текст разбит на неизменные части и поля подстановки,
+    поэтому отрисовка для получателя - это только склейка строк
+    """
+
+    def __init__(self, text):
+        self.parts = MERGE_FIELD_RE.split(text)
+        self.fields = frozenset(self.parts[1::2])
+
+    @property
+    def is_static(self) -> bool:
+        return not self.fields
+
+    def render(self, context: dict) -> str:
+        if self.is_static:
+            return self.parts[0]
+        parts = list(self.parts)
+        parts[1::2] = [context[field] for field in self.parts[1::2]]
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_template(text) -> CompiledTemplate:
+    """Кэш разобранных шаблонов по содержимому: сообщение разбирается один раз, а не для каждого получателя"""
+    return CompiledTemplate(text)
+
+
+def get_unsubscribe_url(email) -> str:
+    token = signing.dumps(email.lower(), salt=UNSUBSCRIBE_SALT, compress=True)
+    return settings.SITE_URL.rstrip("/") + reverse("eservice:unsubscribe", args=[token])
+
+
+def get_unsubscribe_email(token) -> str:
+    """Адрес из токена ссылки для отписки, при поддельном токене выбрасывает signing.BadSignature"""
+    return signing.loads(token, salt=UNSUBSCRIBE_SALT)
+
+
+class Personalizer:
+    """Отрисовка темы и тела сообщения для получателей по шаблонам, разобранным один раз на запуск"""
+
+    def __init__(self, subject, body):
+        self.subject_template = compile_template(subject)
+        self.body_template = compile_template(body)
+        self.fields = self.subject_template.fields | self.body_template.fields
+
+    @property
+    def is_static(self) -> bool:
+        return not self.fields
+
+    def get_context(self, recipient) -> dict:
+        context = {"name": recipient.name or "", "email": recipient.email}
+        # Подпись ссылки - самая дорогая часть, считается только если ссылка есть в шаблоне
+        if "unsubscribe_url" in self.fields:
+            context["unsubscribe_url"] = get_unsubscribe_url(recipient.email)
+        return context
+
+    def render(self, recipient) -> tuple[str, str]:
+        return self.render_context(self.get_context(recipient))
+
+    def render_context(self, context: dict) -> tuple[str, str]:
+        return self.subject_template.render(context), self.body_template.render(context)
+
+    def render_batch(self, recipients):
+        """Поток отрисованных писем (получатель, тема, тело) для последовательности получателей"""
+        for recipient in recipients:
+            subject, body = self.render(recipient)
+            yield recipient, subject, body
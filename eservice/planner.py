@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def static_mx_resolver(domain):
+    """
+    Простейший локальный резолвер MX: берет почтовый сервер домена из настройки EMAIL_MX_HOSTS.
+    Для доменов, которых нет в настройке, почтовым сервером считается сам домен
+    """
+    return settings.EMAIL_MX_HOSTS.get(domain, domain)
+
+
+def get_mx_resolver():
+    """Возвращает резолвер MX из настройки EMAIL_MX_RESOLVER (путь до функции domain -> mx) или None"""
+    if not settings.EMAIL_MX_RESOLVER:
+        return None
+    return import_string(settings.EMAIL_MX_RESOLVER)
+
+
+class DispatchPlanner:
+    """
+    Планировщик отправки: группирует получателей по домену, а если настроен резолвер MX - по почтовому серверу,
+    чтобы письма одного направления шли подряд через одно соединение, а не были размазаны по всей рассылке
+    """
+
+    def __init__(self, resolver=None):
+        self.resolver = resolver
+        self.destinations = {}
+
+    def get_destination(self, email) -> str:
+        domain = email.rpartition("@")[2].lower()
+        if self.resolver is None:
+            return domain
+
+        if domain not in self.destinations:
+            try:
+                self.destinations[domain] = self.resolver(domain) or domain
+            except Exception:
+                # Резолвер недоступен - группируем по домену
+                self.destinations[domain] = domain
+        return self.destinations[domain]
+
+    def plan(self, recipients) -> list[list]:
+        """Возвращает группы получателей, самые большие группы первыми, чтобы они раньше ушли в работу"""
+        groups = {}
+        for recipient in recipients:
+            groups.setdefault(self.get_destination(recipient.email), []).append(recipient)
+        return sorted(groups.values(), key=len, reverse=True)
+
+
+def plan_dispatch(recipients) -> list[list]:
+    return DispatchPlanner(get_mx_resolver()).plan(recipients)
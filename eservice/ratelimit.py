@@ -0,0 +1,104 @@
+import threading
+import time
+
+from django.conf import settings
+
+from eservice.metrics import RATE_LIMIT_WAITS, RATE_LIMIT_WAIT_SECONDS
+
+
+class TokenBucket:
+    """
+    Корзина токенов в виде GCRA: вместо хранения количества токенов хранится теоретическое время
+    следующего письма. Резервирование никогда не отказывает, а возвращает момент, когда письмо можно отправить,
+    поэтому поток писем выравнивается до rate писем в секунду с допустимым всплеском burst писем
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1 / rate
+        self.tolerance = self.interval * (max(1, burst) - 1)
+        self.theoretical_time = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Резервирует место под одно письмо не раньше now, возвращает время, когда письмо можно отправить"""
+        theoretical_time = max(self.theoretical_time, now)
+        send_at = max(now, theoretical_time - self.tolerance)
+        self.theoretical_time = theoretical_time + self.interval
+        return send_at
+
+
+class RateLimiter:
+    """
+    Ограничение скорости отправки для одного SMTP аккаунта: общий предел писем в секунду
+    и отдельный предел для каждого домена получателя. Время ожидания учитывается в метриках
+    по доменам с собственным ограничением (остальные домены - под меткой other)
+    """
+
+    def __init__(self, rate=0, domain_rate=0, domain_rates=None, burst=1):
+        self.rate = rate
+        self.domain_rate = domain_rate
+        self.domain_rates = domain_rates or {}
+        self.burst = burst
+        self.account_bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.domain_buckets = {}
+        self._lock = threading.Lock()
+
+    def get_domain_bucket(self, domain):
+        if domain not in self.domain_buckets:
+            rate = self.domain_rates.get(domain, self.domain_rate)
+            self.domain_buckets[domain] = TokenBucket(rate, self.burst) if rate > 0 else None
+        return self.domain_buckets[domain]
+
+    def reserve(self, email) -> float:
+        """Резервирует отправку письма на адрес email, возвращает сколько секунд нужно подождать"""
+        domain = email.rpartition("@")[2].lower()
+        with self._lock:
+            now = time.monotonic()
+            send_at = now
+            domain_bucket = self.get_domain_bucket(domain)
+            if domain_bucket is not None:
+                send_at = domain_bucket.reserve(send_at)
+            if self.account_bucket is not None:
+                send_at = self.account_bucket.reserve(send_at)
+
+            wait = send_at - now
+        if wait > 0:
+            # Метка - только домены с собственным ограничением, иначе набор меток рос бы с каждым доменом получателя
+            domain_label = domain if domain in self.domain_rates else "other"
+            RATE_LIMIT_WAITS.inc(domain=domain_label)
+            RATE_LIMIT_WAIT_SECONDS.inc(wait, domain=domain_label)
+        return wait
+
+    def acquire(self, email):
+        """Блокирует поток до момента, когда письмо на адрес email можно отправить"""
+        wait = self.reserve(email)
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Ограничители живут все время работы процесса, чтобы выравнивание скорости работало между запусками рассылок
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+# Доля пределов скорости, доступная процессу: процессы пула отправки делят пределы аккаунта между собой
+_rate_share = 1.0
+
+
+def set_process_count(process_count):
+    """Вызывается в процессе пула отправки: пределы скорости делятся поровну между process_count процессами"""
+    global _rate_share
+    _rate_share = 1 / max(1, process_count)
+
+
+def get_rate_limiter(account=None) -> RateLimiter:
+    """Возвращает ограничитель скорости для SMTP аккаунта (по умолчанию EMAIL_HOST_USER)"""
+    account = account or settings.EMAIL_HOST_USER
+    with _rate_limiters_lock:
+        if account not in _rate_limiters:
+            _rate_limiters[account] = RateLimiter(
+                rate=settings.EMAIL_RATE_LIMIT * _rate_share,
+                domain_rate=settings.EMAIL_DOMAIN_RATE_LIMIT * _rate_share,
+                domain_rates={
+                    domain: rate * _rate_share for domain, rate in settings.EMAIL_DOMAIN_RATE_LIMITS.items()
+                },
+                burst=max(1, int(settings.EMAIL_RATE_LIMIT_BURST * _rate_share)),
+            )
+        return _rate_limiters[account]
@@ -0,0 +1,112 @@
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from eservice.models import Newsletter
+
+RESCHEDULE_CHUNK_SIZE = 100_000
+
+# Пересчет следующего времени отправки для диапазона id одним UPDATE, те же правила, что в
+# Newsletter.compute_next_sent_datetime. Расчет ведется в UTC, как и в Python для рассылок, загруженных из БД.
+# Для ежемесячных рассылок, как и relativedelta(...).months, учитываются только месяцы без лет.
+# Строки, у которых время не изменилось, не перезаписываются
+RESCHEDULE_SQL = """
+UPDATE {table} AS newsletter
+SET date_time_next_sent = schedule.date_time_next_sent
+FROM (
+    SELECT
+        id,
+        (CASE
+            WHEN now_time <= start_time THEN start_time
+            WHEN period = %(period_day)s THEN start_time + make_interval(days => days + 1)
+            WHEN period = %(period_week)s THEN start_time + make_interval(days => days + 7 - days %% 7)
+            ELSE start_time + make_interval(months => (
+                months - CASE WHEN start_time + make_interval(months => months) > now_time THEN 1 ELSE 0 END
+            ) %% 12 + 1)
+        END) AT TIME ZONE 'UTC' AS date_time_next_sent
+    FROM (
+        SELECT
+            id,
+            period,
+            start_time,
+            now_time,
+            floor(extract(epoch FROM now_time - start_time) / 86400)::integer AS days,
+            ((extract(year FROM now_time) - extract(year FROM start_time)) * 12
+                + extract(month FROM now_time) - extract(month FROM start_time))::integer AS months
+        FROM (
+            SELECT
+                id,
+                period,
+                date_trunc('minute', date_time_first_sent AT TIME ZONE 'UTC') AS start_time,
+                %(now_time)s::timestamp AS now_time
+            FROM {table}
+            WHERE id >= %(id_from)s AND id < %(id_to)s
+                AND period IN (%(period_day)s, %(period_week)s, %(period_month)s)
+                {active_condition}
+        ) AS chunk
+    ) AS chunk_intervals
+) AS schedule
+WHERE newsletter.id = schedule.id
+    AND newsletter.date_time_next_sent IS DISTINCT FROM schedule.date_time_next_sent
+"""
+
+ACTIVE_CONDITION_SQL = "AND status IN (%(status_created)s, %(status_launched)s)"
+
+
+def get_reschedule_queryset(all_newsletters=False):
+    newsletters = Newsletter.objects.exclude(period=Newsletter.PERIOD_DISABLE)
+    if not all_newsletters:
+        newsletters = newsletters.filter(Newsletter.get_active_schedule_query())
+    return newsletters
+
+
+def reschedule(now_time=None, all_newsletters=False, chunk_size=RESCHEDULE_CHUNK_SIZE) -> int:
+    """
+    Пересчитывает date_time_next_sent рассылок (по умолчанию только активных) в БД, без загрузки строк в Python:
+    рассылки обновляются частями по chunk_size id, каждая часть - один UPDATE в своей транзакции.
+    Возвращает количество рассылок, у которых изменилось время отправки
+    """
+    now_time = (now_time or timezone.now()).astimezone(datetime.timezone.utc)
+    sql = RESCHEDULE_SQL.format(
+        table=Newsletter._meta.db_table,
+        active_condition="" if all_newsletters else ACTIVE_CONDITION_SQL,
+    )
+    params = {
+        "now_time": now_time.replace(second=0, microsecond=0, tzinfo=None),
+        "period_day": Newsletter.PERIOD_EVERY_DAY,
+        "period_week": Newsletter.PERIOD_EVERY_WEEK,
+        "period_month": Newsletter.PERIOD_EVERY_MONTH,
+        "status_created": Newsletter.STATUS_CREATED,
+        "status_launched": Newsletter.STATUS_LAUNCHED,
+    }
+
+    id_range = get_reschedule_queryset(all_newsletters).aggregate(id_from=Min("id"), id_to=Max("id"))
+    if id_range["id_from"] is None:
+        return 0
+
+    updated_count = 0
+    for id_from in range(id_range["id_from"], id_range["id_to"] + 1, chunk_size):
+        params["id_from"] = id_from
+        params["id_to"] = id_from + chunk_size
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            updated_count += cursor.rowcount
+    return updated_count
+
+
+def verify_reschedule(now_time, all_newsletters=False) -> list:
+    """
+    Сверяет время следующей отправки в БД с расчетом Newsletter.compute_next_sent_datetime.
+    Возвращает список расхождений (id, в БД, ожидается)
+    """
+    mismatches = []
+    newsletters = get_reschedule_queryset(all_newsletters).only("id", "period", "date_time_first_sent",
+                                                               "date_time_next_sent")
+    for newsletter in newsletters.iterator(chunk_size=10000):
+        date_time_next_sent = newsletter.date_time_next_sent
+        newsletter.compute_next_sent_datetime(now_time)
+        if newsletter.date_time_next_sent != date_time_next_sent:
+            mismatches.append((newsletter.id, date_time_next_sent, newsletter.date_time_next_sent))
+    return mismatches
@@ -0,0 +1,160 @@
+import heapq
+import select
+import threading
+from datetime import timedelta
+from time import sleep
+
+from django.conf import settings
+from django.db import connection, connections, close_old_connections
+from django.utils import timezone
+
+from eservice.models import Newsletter
+
+SCHEDULER_MODE_INTERVAL = "interval"
+SCHEDULER_MODE_EVENT = "event"
+
+# Канал PostgreSQL LISTEN/NOTIFY, в который сообщается об изменении расписания рассылок
+SCHEDULE_CHANNEL = "eservice_newsletter_schedule"
+
+# Если рассылка осталась к отправке после запуска (ошибка отправки), следующая попытка не раньше чем через
+SCHEDULER_RETRY_DELAY = timedelta(minutes=1)
+
+# Пробуждение диспетчера в этом процессе: изменение рассылки здесь же или уведомление из БД
+schedule_changed = threading.Event()
+
+
+def notify_schedule_changed():
+    """
+    Сообщает диспетчерам об изменении расписания: в этом процессе через событие,
+    в остальных процессах (веб приложение, другой хост) - через NOTIFY PostgreSQL
+    """
+    schedule_changed.set()
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')", [SCHEDULE_CHANNEL])
+
+
+def ceil_minute(date_time):
+    """
+    Рассылки выбираются по времени с отброшенными секундами,
+    поэтому рассылка на 12:00:30 будет выбрана только в 12:01:00
+    """
+    rounded = date_time.replace(second=0, microsecond=0)
+    return rounded if rounded == date_time else rounded + timedelta(minutes=1)
+
+
+class NotificationListener(threading.Thread):
+    """
+    Слушает уведомления PostgreSQL об изменении расписания на отдельном соединении (не из пула Django,
+    чтобы LISTEN не терялся при закрытии старых соединений) и будит диспетчер
+    """
+
+    def __init__(self, timeout):
+        super().__init__(daemon=True, name="newsletter-schedule-listener")
+        self.timeout = timeout
+
+    def run(self):
+        while True:
+            listen_connection = connections.create_connection("default")
+            try:
+                listen_connection.ensure_connection()
+                with listen_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {SCHEDULE_CHANNEL}")
+                # Пока соединения не было, уведомления могли потеряться, поэтому расписание перечитывается
+                schedule_changed.set()
+                self.listen(listen_connection.connection)
+            except Exception as e:
+                print("Ошибка прослушивания уведомлений о расписании:", e)
+                sleep(5)
+            finally:
+                listen_connection.close()
+
+    def listen(self, pg_connection):
+        while True:
+            if select.select([pg_connection], [], [], self.timeout) == ([], [], []):
+                continue
+            pg_connection.poll()
+            if pg_connection.notifies:
+                pg_connection.notifies.clear()
+                schedule_changed.set()
+
+
+_listener = None
+
+
+def start_notification_listener():
+    """Слушатель уведомлений один на процесс, он продолжает работать и после остановки диспетчера"""
+    global _listener
+    if _listener is None:
+        _listener = NotificationListener(settings.NEWSLETTER_SCHEDULER_MAX_SLEEP)
+        _listener.start()
+
+
+class NewsletterDispatcher(threading.Thread):
+    """
+    Планировщик рассылок по событиям вместо опроса БД каждую минуту.
+    Держит кучу ближайших времен отправки активных рассылок и спит до самого раннего из них
+    (но не дольше NEWSLETTER_SCHEDULER_MAX_SLEEP секунд). Просыпается раньше, если рассылку создали или изменили.
+    Расписание перечитывается одним запросом только после пробуждения
+    """
+
+    def __init__(self, job):
+        super().__init__(daemon=True, name="newsletter-dispatcher")
+        self.job = job
+        self.max_sleep = settings.NEWSLETTER_SCHEDULER_MAX_SLEEP
+        self.heap = []
+        self.last_dispatch_time = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        if connection.vendor == "postgresql":
+            start_notification_listener()
+        print("Запуск диспетчера рассылок по событиям...")
+
+        while not self.stopped.is_set():
+            schedule_changed.clear()
+            self.load_schedule()
+            delay = self.get_delay()
+            if delay > 0 and schedule_changed.wait(delay):
+                continue
+            if self.heap and self.heap[0][0] <= timezone.now() and not self.stopped.is_set():
+                self.dispatch()
+        close_old_connections()
+
+    def stop(self):
+        """Остановка после текущей отправки (процесс перестал быть ведущим)"""
+        self.stopped.set()
+        schedule_changed.set()
+
+    def load_schedule(self):
+        close_old_connections()
+        newsletters = Newsletter.objects.filter(
+            Newsletter.get_active_schedule_query(),
+            date_time_next_sent__isnull=False,
+        ).values_list("id", "date_time_first_sent", "date_time_next_sent")
+
+        self.heap = [
+            (self.get_wake_time(max(date_time_first_sent, date_time_next_sent)), newsletter_id)
+            for newsletter_id, date_time_first_sent, date_time_next_sent in newsletters
+        ]
+        heapq.heapify(self.heap)
+
+    def get_wake_time(self, date_time_sent):
+        wake_time = ceil_minute(date_time_sent)
+        if self.last_dispatch_time is not None and wake_time <= self.last_dispatch_time:
+            wake_time = self.last_dispatch_time + SCHEDULER_RETRY_DELAY
+        return wake_time
+
+    def get_delay(self) -> float:
+        if not self.heap:
+            return self.max_sleep
+        return min(self.max_sleep, (self.heap[0][0] - timezone.now()).total_seconds())
+
+    def dispatch(self):
+        self.last_dispatch_time = timezone.now()
+        try:
+            self.job()
+        except Exception as e:
+            print("Ошибка отправки рассылок:", e)
+        finally:
+            close_old_connections()
@@ -1,55 +1,94 @@
+import time
+from datetime import timedelta
+from pathlib import Path
+
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
 from django_apscheduler import util
 from django_apscheduler.jobstores import DjangoJobStore
-from django_apscheduler.models import DjangoJobExecution
+from django_apscheduler.models import DjangoJobExecution, DjangoJob
 
-from eservice.email import send
-from eservice.models import Newsletter, AttemptsNewsletter
+from eservice.circuitbreaker import get_circuit_breaker
+from eservice.dispatch import send_in_processes
+from eservice.email import send, build_send_plan
+from eservice.leader import LeaderElection
+from eservice.metrics import TICK_SECONDS, NEWSLETTERS_DUE, NEWSLETTERS_DISPATCHED, SCHEDULER_LAG_SECONDS, \
+    flush_metrics, delete_old_snapshots
+from eservice.models import Newsletter, AttemptsNewsletter, JobRunTrace
+from eservice.outbox import enqueue, process_batch
+from eservice.scheduler import SCHEDULER_MODE_EVENT, NewsletterDispatcher
+from eservice.tracing import trace_job, span
 
 
 def run_standalone_scheduler():
     """
-    Данная функция для запуска планировщика должна вызываться командной строки python manage.py runapscheduler,
-    так как в ней используется BlockingScheduler, который работает сам по себе и может заблокировать основной поток
-    (Как альтернатива, запуск через отдельный поток по примеру, но и в таком варианте есть проблемы)
-            # from django.core.management import call_command
-            # def callback():
-            #     call_command('runapscheduler')
-            #
-            # from threading import Thread
-            # thr = Thread(target=callback)
-            # thr.start()
+    Данная функция для запуска планировщика должна вызываться командной строки python manage.py runapscheduler.
+    Блокирует текущий поток: ждет, пока процесс станет ведущим, и запускает планировщик
+    (если ведущим уже является процесс веб приложения, команда ждет его остановки)
     """
-    scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
-    scheduler.add_jobstore(DjangoJobStore(), "default")
-
-    add_jobs_executions(scheduler)
+    LeaderElection(start_scheduler).run()
 
 
 def run_application_scheduler():
     """
-    Данная функция для запуска планировщика должна вызываться из веб приложения,
-    так как в ней используется BackgroundScheduler, который опирается на основной процесс
+    Данная функция для запуска планировщика должна вызываться из процессов веб приложения (config/wsgi.py, asgi.py).
+    Планировщик запускается только в одном ведущем процессе, выбор ведущего идет в фоновом потоке
+    """
+    LeaderElection(start_scheduler).start()
+
+
+def start_scheduler():
+    """
+    Запуск планировщика в фоновых потоках (BackgroundScheduler) в ведущем процессе.
+    Возвращает функцию остановки планировщика при потере лидерства
     """
     scheduler = BackgroundScheduler(timezone=settings.TIME_ZONE)
     scheduler.add_jobstore(DjangoJobStore(), "default")
 
-    add_jobs_executions(scheduler)
+    dispatcher = add_jobs_executions(scheduler)
+
+    def stop_scheduler():
+        scheduler.shutdown(wait=False)
+        if dispatcher is not None:
+            dispatcher.stop()
+
+    return stop_scheduler
 
 
 def add_jobs_executions(scheduler):
+    """Добавляет задачи и запускает планировщик, возвращает диспетчер рассылок в режиме event"""
+    dispatcher = None
+    if settings.NEWSLETTER_SCHEDULER_MODE == SCHEDULER_MODE_EVENT:
+        # Рассылки отправляет диспетчер, который просыпается к ближайшему времени отправки,
+        # задача каждую минуту (сохраненная в БД при запуске в режиме interval) не нужна
+        DjangoJob.objects.filter(id="job_every_minute").delete()
+        dispatcher = NewsletterDispatcher(job_every_minute)
+        dispatcher.start()
+        print("Запущен диспетчер рассылок по событиям")
+    else:
+        scheduler.add_job(
+            job_every_minute,
+            trigger='interval',
+            minutes=1,
+            id="job_every_minute",  # The `id` assigned to each job MUST be unique
+            max_instances=1,
+            replace_existing=True
+        )
+        print("Добавлена новая задача")
+
     scheduler.add_job(
-        job_every_minute,
+        job_process_outbox,
         trigger='interval',
-        minutes=1,
-        id="job_every_minute",  # The `id` assigned to each job MUST be unique
+        seconds=settings.OUTBOX_POLL_INTERVAL,
+        id="job_process_outbox",
         max_instances=1,
         replace_existing=True
     )
-    print("Добавлена новая задача")
+    print("Добавлена задача обработки очереди исходящих писем")
 
     scheduler.add_job(
         delete_old_job_executions,
@@ -64,6 +103,7 @@ def add_jobs_executions(scheduler):
 
     print("Запуск планировщика...")
     scheduler.start()
+    return dispatcher
 
 
 def job_every_minute():
@@ -71,23 +111,109 @@ def job_every_minute():
     Периодическая выполняемая задача
     """
     print("Новая минута...")
+    start_time = time.monotonic()
+    try:
+        with trace_job("job_every_minute"):
+            send_ready_newsletters()
+    finally:
+        TICK_SECONDS.observe(time.monotonic() - start_time)
+        flush_metrics(force=True)
+
+
+def send_ready_newsletters():
+    now_time = timezone.now()
+    with span("due_query"):
+        # Сообщения рассылок загружаются тем же запросом, вложения - одним дополнительным,
+        # количество получателей нужно для плана отправки
+        ready_newsletters = list(
+            Newsletter.get_newsletters_ready_to_sent()
+            .select_related("message")
+            .prefetch_related("message__attachments")
+            .annotate(recipients_count=Count("clients"))
+        )
+
+    # Отправленные рассылки и их попытки сохраняются одним пакетом в конце запуска
+    processed_newsletters = []
+    attempts = []
+
+    newsletters = []
+    for newsletter in ready_newsletters:
+        NEWSLETTERS_DUE.inc()
+        SCHEDULER_LAG_SECONDS.observe(max(0.0, (now_time - newsletter.date_time_next_sent).total_seconds()))
+
+        window_minutes = newsletter.get_delivery_window_minutes()
+        if settings.NEWSLETTER_OUTBOX_ENABLED or window_minutes:
+            # Письма отправят воркеры очереди исходящих (с окном доставки - частями в течение окна),
+            # они же сохранят результаты отправки
+            with span("enqueue"):
+                enqueue(newsletter, window_minutes)
+            processed_newsletters.append(newsletter)
+            NEWSLETTERS_DISPATCHED.inc()
+        else:
+            newsletters.append(newsletter)
+
+    if settings.NEWSLETTER_PROCESS_POOL_SIZE > 0 and newsletters and not get_circuit_breaker().is_open:
+        # Рассылки (и части больших рассылок) отправляются параллельно в разных процессах.
+        # При разомкнутом автомате отключения они отправляются здесь: процессы пула создаются заново и не знают
+        # о разомкнутом автомате, а в этом процессе получатели пропускаются, и подключение пробуется одно
+        with span("send_in_processes"):
+            operation_results = send_in_processes(newsletters)
+    else:
+        # Отметки прогресса и получатели всех небольших рассылок читаются до начала отправки
+        with span("send_plan"):
+            send_plan = build_send_plan(newsletters)
+        operation_results = {
+            newsletter.id: send(newsletter, plan=send_plan[newsletter.id])
+            for newsletter in newsletters
+        }
 
-    newsletters = Newsletter.get_newsletters_ready_to_sent()
     for newsletter in newsletters:
-        operation_result = send(newsletter)
-
-        # При каждой отправке обновляем следующее время и статус рассылки
-        newsletter.set_next_sent_datetime()
-        newsletter.refresh_status()
-
-        # Сохранение результатов рассылки
-        AttemptsNewsletter.objects.create(
-            newsletter=newsletter,
-            date_time_last_sent=operation_result[0],
-            status=operation_result[1],
-            mail_server_response=operation_result[2],
-            owner=newsletter.owner
-        )
+        processed_newsletters.append(newsletter)
+        attempts.append(make_attempt(newsletter, operation_results[newsletter.id]))
+        NEWSLETTERS_DISPATCHED.inc()
+
+    finish_newsletters_sending(processed_newsletters, attempts)
+
+
+def make_attempt(newsletter, operation_result) -> AttemptsNewsletter:
+    """Попытка рассылки по результату ее отправки (сохраняется в finish_newsletters_sending)"""
+    return AttemptsNewsletter(
+        newsletter=newsletter,
+        date_time_last_sent=operation_result[0],
+        date_time_occurrence=newsletter.date_time_next_sent,
+        status=operation_result[1],
+        mail_server_response=operation_result[2],
+        owner_id=newsletter.owner_id
+    )
+
+
+def finish_newsletters_sending(newsletters, attempts):
+    """
+    Обновление рассылок и сохранение результатов после их отправки:
+    следующее время и статус вычисляются в памяти и сохраняются вместе с попытками в одной транзакции.
+    Если запуск прервется до этого, повторный запуск не разошлет письма заново: результаты отправки
+    есть в SendCheckpoint, а письма, уже поставленные в очередь исходящих, повторно не добавляются
+    """
+    with span("update_schedule"):
+        for newsletter in newsletters:
+            # При каждой отправке обновляем следующее время и статус рассылки
+            newsletter.compute_next_sent_datetime()
+            newsletter.compute_status()
+
+    with span("save_attempt"), transaction.atomic():
+        Newsletter.objects.bulk_update(newsletters, fields=["date_time_next_sent", "status"])
+        AttemptsNewsletter.objects.bulk_create(attempts)
+
+
+@util.close_old_connections
+def job_process_outbox():
+    """
+    Обработка очереди исходящих писем: повторы после временных ошибок и письма, поставленные в очередь.
+    Выполняется отдельной задачей, поэтому не задерживает отправку новых рассылок в job_every_minute
+    """
+    while process_batch():
+        pass
+    flush_metrics(force=True)
 
 
 @util.close_old_connections
@@ -96,3 +222,9 @@ def delete_old_job_executions(max_age=604_800):
     Задача по очистке логов выполнения каждую неделю
     """
     DjangoJobExecution.objects.delete_old_job_executions(max_age)
+    # Метрики завершенных процессов и старые трассировки запусков
+    delete_old_snapshots(max_age)
+    old_traces = JobRunTrace.objects.filter(started_at__lt=timezone.now() - timedelta(seconds=max_age))
+    for profile_path in old_traces.exclude(profile_path=None).values_list("profile_path", flat=True):
+        Path(profile_path).unlink(missing_ok=True)
+    old_traces.delete()
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from eservice.models import Newsletter
+from eservice.scheduler import SCHEDULER_MODE_EVENT, notify_schedule_changed
+
+
+@receiver(post_save, sender=Newsletter)
+@receiver(post_delete, sender=Newsletter)
+def newsletter_schedule_changed(sender, **kwargs):
+    """Будит планировщик в режиме event, чтобы он перечитал расписание после создания, изменения или удаления рассылки"""
+    if settings.NEWSLETTER_SCHEDULER_MODE == SCHEDULER_MODE_EVENT:
+        # Уведомление после фиксации транзакции, иначе планировщик может прочитать старое расписание
+        transaction.on_commit(notify_schedule_changed)
@@ -0,0 +1,164 @@
+import asyncio
+import random
+import threading
+
+
+class SMTPSink:
+    """
+    Локальный SMTP сервер-приемник, работающий в отдельном потоке внутри процесса.
+    Принимает любые письма (и любую авторизацию) и считает их, не отправляя дальше.
+    Используется для проверки движков отправки без реального почтового сервера.
+    latency - задержка ответа на каждое письмо в секундах, failure_rate - доля получателей (от 0 до 1),
+    которых сервер отклоняет ответом failure_reply (по умолчанию временная ошибка 4xx)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, keep_messages=True, latency=0.0, failure_rate=0.0,
+                 failure_reply="451 4.7.1 Try again later", seed=None):
+        self.host = host
+        self.port = port
+        self.keep_messages = keep_messages
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_reply = failure_reply
+        self._random = random.Random(seed)
+        self.messages = []
+        self.received_count = 0
+        self.rejected_count = 0
+        self.connections_count = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle_client, self.host, self.port, limit=2 ** 20)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def _store_message(self, mail_from, recipients, data):
+        with self._lock:
+            self.received_count += 1
+            if self.keep_messages:
+                self.messages.append((mail_from, recipients, data))
+
+    def _is_rejected(self) -> bool:
+        if not self.failure_rate:
+            return False
+        with self._lock:
+            rejected = self._random.random() < self.failure_rate
+            if rejected:
+                self.rejected_count += 1
+            return rejected
+
+    @staticmethod
+    async def _read_data(reader) -> bytes:
+        """
+        Читает письмо после DATA до строки с точкой и убирает удвоение точек в начале строк.
+        Читает блоками, поэтому быстро принимает и письма с большими вложениями
+        """
+        # Перевод строки в начале, чтобы первая строка письма обрабатывалась как остальные
+        buffer = bytearray(b"\r\n")
+        search_start = 0
+        while (end := buffer.find(b"\r\n.\r\n", search_start)) == -1:
+            search_start = max(0, len(buffer) - 4)
+            block = await reader.read(2 ** 16)
+            if not block:
+                raise asyncio.IncompleteReadError(bytes(buffer), None)
+            buffer += block
+        return bytes(buffer[:end]).replace(b"\r\n..", b"\r\n.")[2:]
+
+    async def _handle_client(self, reader, writer):
+        with self._lock:
+            self.connections_count += 1
+
+        async def reply(line):
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        mail_from, recipients = None, []
+        await reply("220 esender sink ready")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, argument = line.decode("utf-8", "replace").strip().partition(" ")
+                command = command.upper()
+
+                if command == "EHLO":
+                    writer.write(b"250-esender sink\r\n250-8BITMIME\r\n250-SMTPUTF8\r\n")
+                    await reply("250 AUTH PLAIN LOGIN")
+                elif command == "HELO":
+                    await reply("250 esender sink")
+                elif command == "AUTH":
+                    mechanism, _, initial = argument.partition(" ")
+                    # Содержимое авторизации не проверяется, нужно лишь пройти диалог
+                    if mechanism.upper() == "LOGIN":
+                        if not initial:
+                            await reply("334 VXNlcm5hbWU6")
+                            await reader.readline()
+                        await reply("334 UGFzc3dvcmQ6")
+                        await reader.readline()
+                    elif not initial:
+                        await reply("334 ")
+                        await reader.readline()
+                    await reply("235 Authentication successful")
+                elif command == "MAIL":
+                    mail_from, recipients = argument, []
+                    await reply("250 OK")
+                elif command == "RCPT":
+                    if self._is_rejected():
+                        await reply(self.failure_reply)
+                    else:
+                        recipients.append(argument)
+                        await reply("250 OK")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = await self._read_data(reader)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self._store_message(mail_from, recipients, data)
+                    mail_from, recipients = None, []
+                    await reply("250 OK queued")
+                elif command == "RSET":
+                    mail_from, recipients = None, []
+                    await reply("250 OK")
+                elif command == "NOOP":
+                    await reply("250 OK")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
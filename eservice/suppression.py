@@ -0,0 +1,71 @@
+import threading
+import time
+
+from eservice.models import SuppressedEmail
+
+# Удаленные из БД записи не видны при догрузке изменений, поэтому список периодически перечитывается целиком (секунды)
+SUPPRESSION_FULL_RELOAD_INTERVAL = 600
+
+
+class SuppressionList:
+    """
+    Список исключений в памяти процесса. Полностью загружается один раз, а затем догружает только изменения
+    (записи с updated_at не раньше последней загруженной), поэтому изменения применяются без перезапуска
+    планировщика, а проверка адреса перед отправкой - это проверка вхождения в множество.
+    Раз в full_reload_interval секунд список загружается целиком, чтобы убрать удаленные из БД записи
+    """
+
+    def __init__(self, full_reload_interval=SUPPRESSION_FULL_RELOAD_INTERVAL):
+        self.emails = set()
+        self.updated_at = None
+        self.full_reload_interval = full_reload_interval
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.full_reload_interval:
+                self.reload()
+                return self
+
+            suppressed = SuppressedEmail.objects.all()
+            if self.updated_at is not None:
+                # Границу берем включительно: запись с тем же временем могла быть сохранена после прошлой загрузки
+                suppressed = suppressed.filter(updated_at__gte=self.updated_at)
+
+            for email, is_active, updated_at in suppressed.values_list("email", "is_active", "updated_at").iterator():
+                if is_active:
+                    self.emails.add(email)
+                else:
+                    self.emails.discard(email)
+                if self.updated_at is None or updated_at > self.updated_at:
+                    self.updated_at = updated_at
+        return self
+
+    def reload(self):
+        """Полная загрузка действующих записей, вызывается под блокировкой"""
+        self.loaded_at = time.monotonic()
+        emails = set()
+        updated_at = None
+        suppressed = SuppressedEmail.objects.values_list("email", "is_active", "updated_at")
+        for email, is_active, record_updated_at in suppressed.iterator():
+            if is_active:
+                emails.add(email)
+            if updated_at is None or record_updated_at > updated_at:
+                updated_at = record_updated_at
+        self.emails = emails
+        self.updated_at = updated_at
+
+    def is_suppressed(self, email) -> bool:
+        return email.lower() in self.emails
+
+    def __contains__(self, email):
+        return self.is_suppressed(email)
+
+
+_suppression_list = SuppressionList()
+
+
+def get_suppression_list() -> SuppressionList:
+    """Возвращает актуальный список исключений процесса, догружая изменения из БД"""
+    return _suppression_list.refresh()
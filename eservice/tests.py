@@ -1,3 +1,245 @@
+import datetime
+from collections import Counter
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.core import mail
+from django.db import connection
+from django.db.models import Count
 from django.test import TestCase
+from django.utils import timezone
+
+from eservice.dispatch import get_shards
+from eservice.email import EmailSenderPool, build_send_plan, send
+from eservice.models import Message, Newsletter, Client, SendCheckpoint
+from eservice.reschedule import reschedule
+
+
+class NewslettersReadyToSentQueryTestCase(TestCase):
+    """Выбор готовых к отправке рассылок должен использовать частичный индекс, а не просмотр всей таблицы"""
+
+    NEWSLETTERS_COUNT = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        message = Message.objects.create(subject="Тема", body="Тело")
+        now_time = timezone.now()
+        newsletters = []
+        for i in range(cls.NEWSLETTERS_COUNT):
+            # Как в рабочей таблице: почти все рассылки завершены, активные распределены по времени
+            if i % 100 == 50:
+                status, period = Newsletter.STATUS_LAUNCHED, Newsletter.PERIOD_EVERY_DAY
+            else:
+                status, period = Newsletter.STATUS_COMPLETED, Newsletter.PERIOD_DISABLE
+            date_time = now_time + timedelta(minutes=i - cls.NEWSLETTERS_COUNT // 2)
+            newsletters.append(Newsletter(
+                date_time_first_sent=date_time,
+                date_time_next_sent=date_time,
+                period=period,
+                status=status,
+                message=message,
+            ))
+        Newsletter.objects.bulk_create(newsletters, batch_size=1000)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Newsletter._meta.db_table}")
+
+    @skipUnless(connection.vendor == "postgresql", "План запроса проверяется для PostgreSQL, используемой в проекте")
+    def test_uses_due_index(self):
+        plan = Newsletter.get_newsletters_ready_to_sent().explain()
+        self.assertIn("newsletter_due_idx", plan)
+        # Рассылки выбираются уже в порядке индекса, без отдельной сортировки
+        self.assertNotIn("Sort", plan)
+
+    def test_selects_only_active_ready_newsletters(self):
+        newsletters = list(Newsletter.get_newsletters_ready_to_sent())
+        self.assertEqual(len(newsletters), self.NEWSLETTERS_COUNT // 2 // 100)
+        for newsletter in newsletters:
+            self.assertEqual(newsletter.status, Newsletter.STATUS_LAUNCHED)
+        self.assertEqual(
+            [newsletter.date_time_next_sent for newsletter in newsletters],
+            sorted(newsletter.date_time_next_sent for newsletter in newsletters),
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "Пакетный пересчет расписания выполняется SQL запросом PostgreSQL")
+class RescheduleTestCase(TestCase):
+    """Пересчет расписания в БД должен давать то же время, что и Newsletter.compute_next_sent_datetime"""
+
+    # Начала рассылок: конец месяца (31 января и 31 декабря), високосный февраль, время с секундами
+    FIRST_SENT_TIMES = (
+        datetime.datetime(2023, 1, 31, 10, 30, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2023, 3, 15, 10, 0, 45, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2023, 12, 31, 23, 59, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2024, 2, 29, 0, 0, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2023, 11, 20, 8, 15, tzinfo=datetime.timezone.utc),
+    )
+    # Моменты пересчета: после 31 января в коротких месяцах, ровно через год после начала,
+    # переход через границу года, совпадение с началом рассылки и время до начала
+    NOW_TIMES = (
+        datetime.datetime(2023, 2, 15, 12, 0, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2023, 4, 10, 9, 0, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2024, 1, 31, 10, 30, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2024, 3, 15, 10, 0, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2024, 1, 1, 0, 5, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2023, 12, 31, 23, 59, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2022, 6, 1, 0, 0, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2025, 2, 28, 18, 0, tzinfo=datetime.timezone.utc),
+    )
+    PERIODS = (Newsletter.PERIOD_EVERY_DAY, Newsletter.PERIOD_EVERY_WEEK, Newsletter.PERIOD_EVERY_MONTH)
+
+    @classmethod
+    def setUpTestData(cls):
+        message = Message.objects.create(subject="Тема", body="Тело")
+        Newsletter.objects.bulk_create([
+            Newsletter(
+                date_time_first_sent=date_time_first_sent,
+                date_time_next_sent=date_time_first_sent,
+                period=period,
+                status=Newsletter.STATUS_LAUNCHED,
+                message=message,
+            )
+            for date_time_first_sent in cls.FIRST_SENT_TIMES
+            for period in cls.PERIODS
+        ])
+
+    def test_matches_compute_next_sent_datetime(self):
+        for now_time in self.NOW_TIMES:
+            reschedule(now_time, chunk_size=4)
+            for newsletter in Newsletter.objects.all():
+                with self.subTest(now_time=now_time, period=newsletter.period,
+                                  date_time_first_sent=newsletter.date_time_first_sent):
+                    date_time_next_sent = newsletter.date_time_next_sent
+                    newsletter.compute_next_sent_datetime(now_time)
+                    self.assertEqual(date_time_next_sent, newsletter.date_time_next_sent)
+
+    def test_year_later_month_wraps(self):
+        # Для ежемесячных рассылок, как и relativedelta(...).months, учитываются только месяцы без лет
+        now_time = datetime.datetime(2024, 3, 15, 10, 0, tzinfo=datetime.timezone.utc)
+        reschedule(now_time)
+        newsletter = Newsletter.objects.get(
+            date_time_first_sent=self.FIRST_SENT_TIMES[1], period=Newsletter.PERIOD_EVERY_MONTH
+        )
+        self.assertEqual(newsletter.date_time_next_sent,
+                         datetime.datetime(2023, 4, 15, 10, 0, tzinfo=datetime.timezone.utc))
+
+    def test_skips_completed_newsletters(self):
+        Newsletter.objects.filter(period=Newsletter.PERIOD_EVERY_DAY).update(status=Newsletter.STATUS_COMPLETED)
+        now_time = datetime.datetime(2024, 3, 15, 10, 0, tzinfo=datetime.timezone.utc)
+        reschedule(now_time)
+        for newsletter in Newsletter.objects.filter(period=Newsletter.PERIOD_EVERY_DAY):
+            self.assertEqual(newsletter.date_time_next_sent, newsletter.date_time_first_sent)
+
+
+def crash_on_call(call_number):
+    """
+    Отправка пачки с номером call_number падает, успев отправить двух первых получателей
+    (процесс упал посреди пачки, до сохранения ее результатов)
+    """
+    original_send_groups = EmailSenderPool.send_groups
+    calls = []
+
+    def send_groups(sender, prepared, groups):
+        calls.append(groups)
+        if len(calls) == call_number:
+            original_send_groups(sender, prepared, [groups[0][:2]])
+            raise RuntimeError("Процесс упал")
+        return original_send_groups(sender, prepared, groups)
+
+    return mock.patch.object(EmailSenderPool, "send_groups", send_groups)
+
+
+class SendCheckpointTestCase(TestCase):
+    """Прерванная отправка продолжается с отметки прогресса без пропусков, завершенная повторно не отправляется"""
+
+    CLIENTS_COUNT = 10
+
+    def setUp(self):
+        message = Message.objects.create(subject="Тема", body="Тело")
+        date_time = timezone.now() - timedelta(minutes=5)
+        self.newsletter = Newsletter.objects.create(
+            date_time_first_sent=date_time,
+            date_time_next_sent=date_time,
+            period=Newsletter.PERIOD_EVERY_DAY,
+            message=message,
+        )
+        self.clients = Client.objects.bulk_create([
+            Client(name=f"Клиент {i}", email=f"client{i}@example.com") for i in range(self.CLIENTS_COUNT)
+        ])
+        self.newsletter.clients.set(self.clients)
+
+    def get_plan(self):
+        """Рассылка и ее план отправки, как в запуске планировщика"""
+        newsletter = Newsletter.objects.annotate(recipients_count=Count("clients")).get(id=self.newsletter.id)
+        return newsletter, build_send_plan([newsletter])[newsletter.id]
+
+    def get_checkpoints(self):
+        return SendCheckpoint.objects.filter(
+            newsletter=self.newsletter, date_time_occurrence=self.newsletter.date_time_next_sent
+        )
+
+    def get_sent_emails(self) -> Counter:
+        return Counter(email for message in mail.outbox for email in message.to)
+
+    def assert_resumed_after_crash(self):
+        sent_emails = self.get_sent_emails()
+        self.assertEqual(set(sent_emails), {client.email for client in self.clients})
+        # Повторно уходят только письма пачки, на которой упал процесс: вторая пачка (клиенты 4-7)
+        # была отправлена частично, ее отметка не сохранилась
+        self.assertEqual({email for email, count in sent_emails.items() if count > 1},
+                         {self.clients[4].email, self.clients[5].email})
+        checkpoint = self.get_checkpoints().get()
+        self.assertTrue(checkpoint.is_completed)
+        self.assertEqual(checkpoint.get_operation_result()[1:], (True, "OK"))
+
+    @mock.patch("eservice.email.RECIPIENTS_CHUNK_SIZE", 4)
+    def test_resume_after_crash_mid_chunk(self):
+        with crash_on_call(2), self.assertRaises(RuntimeError):
+            send(self.newsletter)
+        checkpoint = self.get_checkpoints().get()
+        self.assertEqual(checkpoint.last_client_id, self.clients[3].id)
+        self.assertFalse(checkpoint.is_completed)
+
+        send(self.newsletter)
+        self.assert_resumed_after_crash()
+
+    @mock.patch("eservice.email.RECIPIENTS_CHUNK_SIZE", 4)
+    def test_resume_after_crash_mid_chunk_with_plan(self):
+        newsletter, plan = self.get_plan()
+        self.assertIsNotNone(plan.recipients)
+        with crash_on_call(2), self.assertRaises(RuntimeError):
+            send(newsletter, plan=plan)
+        self.assertEqual(self.get_checkpoints().get().last_client_id, self.clients[3].id)
+
+        # Следующий запуск строит план заново и читает сохраненную отметку
+        newsletter, plan = self.get_plan()
+        self.assertEqual(plan.checkpoint.last_client_id, self.clients[3].id)
+        send(newsletter, plan=plan)
+        self.assert_resumed_after_crash()
+
+    def test_completed_checkpoint_returns_stored_result(self):
+        checkpoint = SendCheckpoint.objects.create(
+            newsletter=self.newsletter,
+            date_time_occurrence=self.newsletter.date_time_next_sent,
+            last_client_id=self.clients[-1].id,
+            is_completed=True,
+            status=False,
+            mail_server_response="550 Mailbox unavailable",
+        )
+        self.assertEqual(send(self.newsletter), checkpoint.get_operation_result())
+        newsletter, plan = self.get_plan()
+        self.assertEqual(send(newsletter, plan=plan), checkpoint.get_operation_result())
+        self.assertEqual(mail.outbox, [])
+
+    def test_unstarted_shards_sent_after_first_shard(self):
+        shards = get_shards(self.newsletter, shard_size=3)
+        self.assertEqual(len(shards), 4)
+        send(self.newsletter, shards[0])
+
+        # Процесс упал после первой части: границы частей те же, неначатые части не теряются
+        self.assertEqual(get_shards(self.newsletter, shard_size=3), shards)
+        for shard in shards[1:]:
+            send(self.newsletter, shard)
 
-# Create your tests here.
+        self.assertEqual(self.get_sent_emails(), Counter({client.email: 1 for client in self.clients}))
+        self.assertEqual(self.get_checkpoints().filter(is_completed=True).count(), len(shards))
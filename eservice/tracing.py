@@ -0,0 +1,90 @@
+import cProfile
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from eservice.models import JobRunTrace
+
+_current_trace = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Разбивка времени одного запуска задачи по этапам: суммарное время и количество вызовов каждого этапа"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started_at = timezone.now()
+        self.start_time = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+        stage["seconds"] += seconds
+        stage["count"] += 1
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self.start_time
+
+
+@contextmanager
+def span(name):
+    """
+    Замер этапа текущего запуска задачи. Вне запуска с трассировкой ничего не делает,
+    поэтому может стоять в любом коде, в том числе вызываемом не из планировщика
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start_time)
+
+
+@contextmanager
+def trace_job(job_id):
+    """
+    Трассировка запуска задачи: по завершении разбивка по этапам сохраняется в JobRunTrace.
+    Для доли запусков JOB_TRACE_PROFILE_RATE дополнительно сохраняется профиль cProfile (файл pstats)
+    """
+    if not settings.JOB_TRACE_ENABLED:
+        yield
+        return
+
+    trace = Trace(job_id)
+    token = _current_trace.set(trace)
+    profiler = cProfile.Profile() if random.random() < settings.JOB_TRACE_PROFILE_RATE else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield trace
+    finally:
+        profile_path = None
+        if profiler is not None:
+            profiler.disable()
+            profile_path = dump_profile(profiler, trace)
+        _current_trace.reset(token)
+        JobRunTrace.objects.create(
+            job_id=job_id,
+            started_at=trace.started_at,
+            duration=trace.duration,
+            stages=trace.stages,
+            profile_path=profile_path,
+        )
+
+
+def dump_profile(profiler, trace) -> str:
+    """Сохраняет профиль запуска, посмотреть можно через python -m pstats <файл>"""
+    profile_dir = Path(settings.JOB_TRACE_PROFILE_DIR)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    path = profile_dir / f"{trace.job_id}_{trace.started_at:%Y%m%d_%H%M%S}.pstats"
+    profiler.dump_stats(path)
+    return str(path)
@@ -6,7 +6,7 @@ from eservice.apps import EserviceConfig
 from eservice.views import MessageListView, MessageCreateView, MessageUpdateView, MessageDetailView, message_delete, \
     ClientListView, ClientDetailView, ClientCreateView, ClientUpdateView, client_delete, NewsletterListView, \
     NewsletterCreateView, NewsletterUpdateView, NewsletterDetailView, newsletter_delete, AttemptsNewsletterListView, \
-    index
+    index, unsubscribe, metrics
 
 app_name = EserviceConfig.name
 
@@ -32,5 +32,8 @@ urlpatterns = [
     path('newsletter_detail/<int:pk>', NewsletterDetailView.as_view(), name='newsletter_detail'),
     path('newsletter_delete/<int:pk>', newsletter_delete, name='newsletter_delete'),
 
+    path('unsubscribe/<str:token>/', unsubscribe, name='unsubscribe'),
+    path('metrics', metrics, name='metrics'),
+
     path('attempts_newsletter_list', cache_page(60)(AttemptsNewsletterListView.as_view()), name='attempts_newsletter_list'),
 ]
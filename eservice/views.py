@@ -1,13 +1,19 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.core import signing
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.template import loader
 from django.urls import reverse_lazy, reverse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import ListView, CreateView, DetailView, UpdateView
 
 from blog.models import Blog
 from eservice.forms import NewsletterForm, NewsletterModeratorForm
-from eservice.models import Message, Client, Newsletter, AttemptsNewsletter
+from eservice.metrics import render_metrics
+from eservice.models import Message, Client, Newsletter, AttemptsNewsletter, SuppressedEmail
+from eservice.personalization import get_unsubscribe_email
 from eservice.views_services import AutoOwnerMixin, delete, ObjectsListAccessMixin, ObjectDetailAccessMixin, \
     is_super_or_owner, CustomLoginRequiredMixin, CustomLoginRequiredMixin2, is_user_manager, CustomLoginRequiredMixin3
 
@@ -154,3 +160,45 @@ def index(request):
         'context': data,
     }
     return HttpResponse(template.render(context, request))
+
+
+# Без проверки CSRF: POST отправляют почтовые клиенты по заголовку List-Unsubscribe-Post, подписанный токен
+# в ссылке защищает от отписки чужого адреса
+@csrf_exempt
+def unsubscribe(request, token):
+    """
+    Отписка от рассылок по ссылке из письма. GET показывает страницу подтверждения (ссылки открывают и
+    почтовые сканеры), адрес добавляется в список исключений только по POST: из формы или отписка в один клик
+    """
+    try:
+        email = get_unsubscribe_email(token)
+    except signing.BadSignature:
+        raise Http404
+
+    if request.method != 'POST':
+        template = loader.get_template('eservice/unsubscribe_confirm.html')
+        context = {
+            'email': email,
+        }
+        return HttpResponse(template.render(context, request))
+
+    SuppressedEmail.suppress([email], SuppressedEmail.REASON_UNSUBSCRIBE)
+    template = loader.get_template('eservice/unsubscribe.html')
+    context = {
+        'email': email,
+    }
+    return HttpResponse(template.render(context, request))
+
+
+def metrics(request):
+    """
+    Метрики планировщика и отправки писем всех процессов в текстовом формате Prometheus.
+    Доступны сотрудникам (is_staff) и по токену METRICS_TOKEN в заголовке Authorization: Bearer <токен>
+    """
+    authorization = request.headers.get('Authorization', '')
+    has_token = bool(settings.METRICS_TOKEN) and constant_time_compare(
+        authorization, f'Bearer {settings.METRICS_TOKEN}'
+    )
+    if not has_token and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -20,6 +20,10 @@ def generate_filename_blog(instance, filename):
     return generate_filename(instance, filename, 'blog')
 
 
+def generate_filename_attachment(instance, filename):
+    return generate_filename(instance, filename, 'attachments')
+
+
 def generate_filename(instance, filename, subdir):
     return pathlib.Path(subdir) / f"{uuid.uuid4().hex}.{filename.split('.')[-1]}"
 